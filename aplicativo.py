@@ -1,23 +1,106 @@
 import streamlit as st
 from streamlit_option_menu import option_menu
 import psycopg2
-from psycopg2 import OperationalError
-from datetime import datetime, date
+from psycopg2 import OperationalError, InterfaceError
+from psycopg2.errors import QueryCanceled
+from psycopg2.pool import ThreadedConnectionPool
+from datetime import datetime, date, timedelta
 import pandas as pd
 from PIL import Image
 import requests
 from io import BytesIO
+import os
+import random
+import re
+import json
+import threading
+import time
+import logging
+import shutil
+import tempfile
+from collections import defaultdict
+import numpy as np
+import plotly.express as px
+from recursos import process_singleton
+
+logger = logging.getLogger(__name__)
 
 ########################
 # UTILIDADES GERAIS
 ########################
+def round_cents(values):
+    """
+    Converte valores em reais para centavos inteiros, arredondando meio centavo
+    para longe do zero (0.015 -> 2, -0.015 -> -2). Usado por format_currency e
+    format_currency_series para que os dois sempre formatem o mesmo valor igual.
+    """
+    values = np.asarray(values, dtype="float64") * 100
+    return np.trunc(values + np.copysign(0.5, values)).astype(np.int64)
+
+
 def format_currency(value: float) -> str:
     """
     Formata um valor para o formato monetário brasileiro: R$ x.xx
     Exemplo:
         1234.56 -> "R$ 1.234,56"
     """
-    return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    cents = int(round_cents(value))
+    sign = "-" if cents < 0 else ""
+    reais, rest = divmod(abs(cents), 100)
+    return f"R$ {sign}{reais:,}".replace(",", ".") + f",{rest:02d}"
+
+
+def format_currency_series(values) -> pd.Series:
+    """
+    Versão vetorizada de format_currency para uma Series inteira.
+    Trabalha em centavos inteiros com operações NumPy, sem formatar valor a valor.
+    Valores nulos viram string vazia.
+    """
+    values = pd.Series(values)
+    numbers = values.to_numpy(dtype="float64", na_value=np.nan)
+    missing = np.isnan(numbers)
+    cents = round_cents(np.where(missing, 0, numbers))
+    sign = np.where(cents < 0, "-", "")
+    cents = np.abs(cents)
+
+    reais = cents // 100
+    rest = reais // 1000
+    group = (reais % 1000).astype(str)
+    text = np.where(rest > 0, np.char.zfill(group, 3), group)
+    while np.any(rest > 0):
+        active = rest > 0
+        group = (rest % 1000).astype(str)
+        rest = rest // 1000
+        group = np.where(rest > 0, np.char.zfill(group, 3), group)
+        text = np.where(active, np.char.add(np.char.add(group, "."), text), text)
+
+    decimals = np.char.zfill((cents % 100).astype(str), 2)
+    formatted = np.char.add(np.char.add(np.char.add("R$ ", sign), np.char.add(text, ",")), decimals)
+    return pd.Series(np.where(missing, "", formatted), index=values.index, dtype="object")
+
+
+def render_bounded_table(df: pd.DataFrame, key: str, page_size: int = 20):
+    """
+    Exibe apenas as primeiras linhas de um DataFrame com st.table e um botão
+    "Mostrar mais" que amplia o limite em `page_size`, mantendo o tamanho da
+    página constante mesmo com o histórico crescendo.
+    """
+    limit_key = f"{key}_limit"
+    limit = st.session_state.get(limit_key, page_size)
+    st.table(df.head(limit))
+    if len(df) > limit:
+        st.caption(f"Exibindo {limit} de {len(df)} linhas.")
+        # O limite é ampliado no callback, antes do rerun que o clique já provoca.
+        st.button(
+            "Mostrar mais",
+            key=f"{key}_more",
+            on_click=_show_more_rows,
+            args=(limit_key, page_size),
+        )
+
+
+def _show_more_rows(limit_key: str, page_size: int):
+    st.session_state[limit_key] = st.session_state.get(limit_key, page_size) + page_size
 
 
 def download_df_as_csv(df: pd.DataFrame, filename: str, label: str = "Baixar CSV"):
@@ -34,86 +117,539 @@ def download_df_as_csv(df: pd.DataFrame, filename: str, label: str = "Baixar CSV
 
 
 ########################
-# CONEXÃO COM BANCO (SEM CACHE)
+# CONEXÃO COM BANCO (POOL)
 ########################
+DB_POOL_MIN = 1
+DB_POOL_MAX = 10
+DB_POOL_WAIT_SECONDS = 5
+DB_CONNECT_TIMEOUT_SECONDS = 3
+DB_STATEMENT_TIMEOUT_MS = 15000
+DB_RETRIES = 2
+DB_RETRY_BASE_SECONDS = 0.2
+DB_BREAKER_THRESHOLD = 3
+DB_BREAKER_COOLDOWN_SECONDS = 30
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """
+    Conexão que lembra quais consultas do PREPARED_QUERIES já foram preparadas nela.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+@process_singleton
+def get_db_pool():
+    """
+    Cria (uma vez por processo) o pool de conexões compartilhado por todas as sessões.
+    Os tempos limite de conexão e de execução e o tamanho do pool podem ser definidos
+    em st.secrets["db"] (connect_timeout em segundos, statement_timeout em
+    milissegundos, pool_max em conexões).
+    """
+    connect_timeout = st.secrets["db"].get("connect_timeout", DB_CONNECT_TIMEOUT_SECONDS)
+    statement_timeout = st.secrets["db"].get("statement_timeout", DB_STATEMENT_TIMEOUT_MS)
+    return ThreadedConnectionPool(
+        DB_POOL_MIN,
+        db_pool_max(),
+        host=st.secrets["db"]["host"],
+        database=st.secrets["db"]["name"],
+        user=st.secrets["db"]["user"],
+        password=st.secrets["db"]["password"],
+        port=st.secrets["db"]["port"],
+        connect_timeout=connect_timeout,
+        options=f"-c statement_timeout={int(statement_timeout)}",
+        connection_factory=PreparedConnection,
+    )
+
+
+def db_pool_max() -> int:
+    return int(st.secrets["db"].get("pool_max", DB_POOL_MAX))
+
+
+@process_singleton
+def get_db_pool_slots():
+    """
+    Semáforo com uma vaga por conexão do pool. O ThreadedConnectionPool levanta
+    PoolError quando esgotado; quem pede uma conexão espera aqui por uma vaga
+    (até DB_POOL_WAIT_SECONDS) antes de chamar getconn.
+    """
+    return threading.BoundedSemaphore(db_pool_max())
+
+
+@process_singleton
+def get_db_breaker():
+    """
+    Disjuntor (circuit breaker) do banco, compartilhado pelo processo.
+    Após DB_BREAKER_THRESHOLD falhas seguidas de conexão ou execução, todas as
+    consultas são recusadas imediatamente por DB_BREAKER_COOLDOWN_SECONDS.
+    """
+    return {"lock": threading.Lock(), "failures": 0, "open_until": 0.0}
+
+
+def db_breaker_remaining() -> float:
+    """
+    Segundos restantes com o disjuntor aberto (0 quando fechado).
+    """
+    breaker = get_db_breaker()
+    with breaker["lock"]:
+        return max(0.0, breaker["open_until"] - time.monotonic())
+
+
+def _record_db_success():
+    breaker = get_db_breaker()
+    with breaker["lock"]:
+        breaker["failures"] = 0
+
+
+def _record_db_failure():
+    breaker = get_db_breaker()
+    with breaker["lock"]:
+        breaker["failures"] += 1
+        if breaker["failures"] >= DB_BREAKER_THRESHOLD:
+            breaker["open_until"] = time.monotonic() + DB_BREAKER_COOLDOWN_SECONDS
+
+
+def _is_transient_db_error(error) -> bool:
+    """
+    Falhas de conexão valem nova tentativa; estouro do statement_timeout não.
+    """
+    return isinstance(error, (OperationalError, InterfaceError)) and not isinstance(error, QueryCanceled)
+
+
+def _retry_delay(attempt: int) -> float:
+    return random.uniform(0, DB_RETRY_BASE_SECONDS * 2 ** attempt)
+
+
 def get_db_connection():
     """
-    Retorna uma conexão com o banco de dados usando st.secrets e psycopg2.
-    Abre e fecha a cada consulta (sem uso de cache).
+    Retorna uma conexão do pool. Toda conexão obtida aqui deve ser devolvida
+    com release_db_connection. Com o pool esgotado espera até DB_POOL_WAIT_SECONDS
+    por uma conexão livre. Falhas de conexão são repetidas até DB_RETRIES
+    vezes (com espera aleatória); com o disjuntor aberto retorna None na hora.
     """
-    try:
-        conn = psycopg2.connect(
-            host=st.secrets["db"]["host"],
-            database=st.secrets["db"]["name"],
-            user=st.secrets["db"]["user"],
-            password=st.secrets["db"]["password"],
-            port=st.secrets["db"]["port"]
-        )
-        return conn
-    except OperationalError:
-        st.error("Não foi possível conectar ao banco de dados. Por favor, tente novamente mais tarde.")
+    remaining = db_breaker_remaining()
+    if remaining > 0:
+        st.error(f"Banco de dados indisponível. Nova tentativa em {remaining:.0f} s.")
+        return None
+    slots = get_db_pool_slots()
+    if not slots.acquire(timeout=DB_POOL_WAIT_SECONDS):
+        st.error("Todas as conexões com o banco estão em uso. Por favor, tente novamente.")
         return None
+    for attempt in range(DB_RETRIES + 1):
+        remaining = db_breaker_remaining()
+        if remaining > 0:
+            slots.release()
+            st.error(f"Banco de dados indisponível. Nova tentativa em {remaining:.0f} s.")
+            return None
+        try:
+            return get_db_pool().getconn()
+        except psycopg2.pool.PoolError:
+            slots.release()
+            st.error("Todas as conexões com o banco estão em uso. Por favor, tente novamente.")
+            return None
+        except OperationalError:
+            _record_db_failure()
+            if attempt < DB_RETRIES:
+                time.sleep(_retry_delay(attempt))
+    slots.release()
+    st.error("Não foi possível conectar ao banco de dados. Por favor, tente novamente mais tarde.")
+    return None
+
+
+def release_db_connection(conn):
+    """
+    Devolve a conexão ao pool, encerrando qualquer transação pendente.
+    Conexões quebradas são fechadas em vez de reaproveitadas.
+    """
+    if not conn.closed:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+    try:
+        get_db_pool().putconn(conn, close=bool(conn.closed))
+    finally:
+        get_db_pool_slots().release()
 
 
 def run_query(query, values=None):
     """
     Executa uma consulta de leitura (SELECT) e retorna os dados obtidos.
-    Abre e fecha a conexão a cada chamada.
+    Falhas transitórias de conexão são repetidas até DB_RETRIES vezes.
+    """
+    for attempt in range(DB_RETRIES + 1):
+        conn = get_db_connection()
+        if conn is None:
+            return []
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, values or ())
+                rows = cursor.fetchall()
+            _record_db_success()
+            return rows
+        except Exception as e:
+            if _is_transient_db_error(e):
+                _record_db_failure()
+                if attempt < DB_RETRIES:
+                    time.sleep(_retry_delay(attempt))
+                    continue
+            st.error(f"Erro ao executar a consulta: {e}")
+            return []
+        finally:
+            release_db_connection(conn)
+
+
+#####################
+# CONSULTAS PREPARADAS
+#####################
+PREPARED_QUERIES = {
+    "open_clients": """
+        SELECT DISTINCT "Cliente" FROM public.vw_pedido_produto WHERE status = $1
+    """,
+    "client_open_items": """
+        SELECT "Produto", "Quantidade", "total"
+        FROM public.vw_pedido_produto
+        WHERE "Cliente" = $1 AND status = $2
+    """,
+    "open_orders_summary": """
+        SELECT "Cliente", SUM("total") as Total
+        FROM public.vw_pedido_produto
+        WHERE status = $1
+        GROUP BY "Cliente"
+        ORDER BY "Cliente" DESC
+    """,
+    "closed_orders_summary": """
+        SELECT DATE("Data") as Date, SUM("total") as Total
+        FROM public.vw_pedido_produto
+        WHERE status != $1
+        GROUP BY DATE("Data")
+        ORDER BY DATE("Data") DESC
+    """,
+    "insert_order": """
+        WITH novo AS (
+            INSERT INTO public.tb_pedido ("Cliente", "Produto", "Quantidade", "Data", status)
+            VALUES ($1, $2, $3, $4, 'em aberto')
+            RETURNING "Cliente", "Produto", "Quantidade", "Data", status
+        )
+        INSERT INTO public.tb_pedido_evento (tipo, "Cliente", "Produto", "Quantidade", "Data", status)
+        SELECT 'created', "Cliente", "Produto", "Quantidade", "Data", status FROM novo
+    """,
+    "settle_client_orders": """
+        WITH abertos AS (
+            SELECT "Cliente", "Produto", "Quantidade", "Data"
+            FROM public.tb_pedido
+            WHERE "Cliente" = $2 AND status = 'em aberto'
+        ),
+        pagos AS (
+            UPDATE public.tb_pedido
+            SET status = $1, "Data" = CURRENT_TIMESTAMP
+            WHERE "Cliente" = $2 AND status = 'em aberto'
+        )
+        INSERT INTO public.tb_pedido_evento (tipo, "Cliente", "Produto", "Quantidade", "Data", status, anterior)
+        SELECT 'paid', "Cliente", "Produto", "Quantidade", CURRENT_TIMESTAMP, $1,
+               jsonb_build_object('Data', "Data", 'status', 'em aberto')
+        FROM abertos
+    """,
+}
+
+
+PREPARED_PLAN_SAMPLE_EVERY = 20
+
+
+@process_singleton
+def get_prepared_stats():
+    """
+    Estatísticas por consulta preparada, compartilhadas pelo processo:
+    quantas vezes foi preparada/executada e o tempo gasto em cada etapa.
+    A cada PREPARED_PLAN_SAMPLE_EVERY execuções também é medido, via EXPLAIN
+    (que não executa a consulta), o tempo de planejamento da versão preparada e
+    do mesmo SQL enviado sem preparar, como base de comparação.
+    """
+    return {
+        "lock": threading.Lock(),
+        "queries": {
+            name: {
+                "prepares": 0, "prepare_ms": 0.0, "executions": 0, "execute_ms": 0.0,
+                "plan_samples": 0, "plan_prepared_ms": 0.0, "plan_unprepared_ms": 0.0,
+            }
+            for name in PREPARED_QUERIES
+        },
+    }
+
+
+def _record_prepared_stat(name, field, elapsed_ms):
+    stats = get_prepared_stats()
+    counter = "prepares" if field == "prepare_ms" else "executions"
+    with stats["lock"]:
+        stats["queries"][name][counter] += 1
+        stats["queries"][name][field] += elapsed_ms
+
+
+def _explain_planning_ms(cursor, query, values):
+    cursor.execute(f"EXPLAIN (SUMMARY ON, FORMAT JSON) {query}", values)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Planning Time"]
+
+
+def _sample_planning(cursor, name, execute_sql, values):
+    """
+    Mede o planejamento da consulta preparada e do SQL equivalente sem preparar
+    (parâmetros $n trocados pelos valores). Roda num SAVEPOINT para que uma falha
+    na medição não aborte a transação de quem chamou.
+    """
+    positions = [int(n) - 1 for n in re.findall(r"\$(\d+)", PREPARED_QUERIES[name])]
+    unprepared_sql = re.sub(r"\$\d+", "%s", PREPARED_QUERIES[name])
+    cursor.execute("SAVEPOINT plan_sample")
+    try:
+        prepared_ms = _explain_planning_ms(cursor, execute_sql, values)
+        unprepared_ms = _explain_planning_ms(cursor, unprepared_sql, [values[i] for i in positions])
+    except psycopg2.Error:
+        cursor.execute("ROLLBACK TO SAVEPOINT plan_sample")
+        return
+    cursor.execute("RELEASE SAVEPOINT plan_sample")
+    stats = get_prepared_stats()
+    with stats["lock"]:
+        item = stats["queries"][name]
+        item["plan_samples"] += 1
+        item["plan_prepared_ms"] += prepared_ms
+        item["plan_unprepared_ms"] += unprepared_ms
+
+
+def execute_prepared(conn, cursor, name, values=()):
+    """
+    Executa a consulta `name` do PREPARED_QUERIES. Na primeira vez em cada
+    conexão do pool ela é preparada (PREPARE); depois só é executada pelo nome.
+    """
+    if name not in conn.prepared:
+        start = time.perf_counter()
+        cursor.execute(f"PREPARE {name} AS {PREPARED_QUERIES[name]}")
+        _record_prepared_stat(name, "prepare_ms", (time.perf_counter() - start) * 1000)
+        conn.prepared.add(name)
+
+    placeholders = ", ".join(["%s"] * len(values))
+    execute_sql = f"EXECUTE {name} ({placeholders})" if values else f"EXECUTE {name}"
+    if get_prepared_stats()["queries"][name]["executions"] % PREPARED_PLAN_SAMPLE_EVERY == 0:
+        _sample_planning(cursor, name, execute_sql, values)
+    start = time.perf_counter()
+    cursor.execute(execute_sql, values)
+    _record_prepared_stat(name, "execute_ms", (time.perf_counter() - start) * 1000)
+
+
+def prepared_stats_df() -> pd.DataFrame:
+    stats = get_prepared_stats()
+    with stats["lock"]:
+        rows = [
+            (
+                name,
+                item["prepares"],
+                item["prepare_ms"],
+                item["executions"],
+                item["execute_ms"] / item["executions"] if item["executions"] else 0.0,
+                item["plan_prepared_ms"] / item["plan_samples"] if item["plan_samples"] else None,
+                item["plan_unprepared_ms"] / item["plan_samples"] if item["plan_samples"] else None,
+            )
+            for name, item in stats["queries"].items()
+        ]
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "Query", "Prepares", "Prepare ms", "Executions", "Avg execute ms",
+            "Avg plan ms (prepared)", "Avg plan ms (unprepared)",
+        ],
+    )
+
+
+#####################
+# CONSULTAS TIPADAS (DATAFRAME)
+#####################
+TIMESTAMP_OID = 1114
+NUMERIC_AS_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values,
+    "NUMERIC_AS_FLOAT",
+    lambda value, cursor: float(value) if value is not None else None,
+)
+TIMESTAMP_AS_TEXT = psycopg2.extensions.new_type((TIMESTAMP_OID,), "TIMESTAMP_AS_TEXT", lambda value, cursor: value)
+CATEGORY_MAX_RATIO = 0.5
+
+
+class QueryError(Exception):
+    """
+    Falha de uma consulta de leitura, levantada quando quem chama precisa
+    distinguir "sem dados" de "sem banco" (relatórios e tarefas em segundo plano).
+    """
+
+
+def run_query_df(query, columns, values=None, categorical=(), raise_errors=False):
+    """
+    Executa uma consulta de leitura (SELECT) e retorna um DataFrame já tipado:
+    NUMERIC vira float64 direto no driver (sem objetos Decimal), TIMESTAMP chega
+    como texto e é convertido de uma vez para datetime64, e as colunas em
+    `categorical` viram category quando têm poucos valores distintos.
+    Em caso de erro retorna um DataFrame vazio com as colunas informadas, ou
+    levanta QueryError se `raise_errors` for verdadeiro.
+    """
+    return _fetch_df(lambda conn, cursor: cursor.execute(query, values or ()), columns, categorical, raise_errors)
+
+
+def run_prepared_df(name, columns, values=(), categorical=(), raise_errors=False):
+    """
+    Igual a run_query_df, mas executa a consulta preparada `name` do PREPARED_QUERIES.
+    """
+    return _fetch_df(
+        lambda conn, cursor: execute_prepared(conn, cursor, name, values), columns, categorical, raise_errors
+    )
+
+
+def _fetch_df(execute, columns, categorical, raise_errors=False):
+    for attempt in range(DB_RETRIES + 1):
+        conn = get_db_connection()
+        if conn is None:
+            if raise_errors:
+                raise QueryError("Sem conexão com o banco de dados.")
+            return pd.DataFrame(columns=columns)
+        try:
+            with conn.cursor() as cursor:
+                psycopg2.extensions.register_type(NUMERIC_AS_FLOAT, cursor)
+                psycopg2.extensions.register_type(TIMESTAMP_AS_TEXT, cursor)
+                execute(conn, cursor)
+                rows = cursor.fetchall()
+                type_codes = [col.type_code for col in cursor.description]
+            _record_db_success()
+            break
+        except Exception as e:
+            if _is_transient_db_error(e):
+                _record_db_failure()
+                if attempt < DB_RETRIES:
+                    time.sleep(_retry_delay(attempt))
+                    continue
+            if raise_errors:
+                raise QueryError(str(e)) from e
+            st.error(f"Erro ao executar a consulta: {e}")
+            return pd.DataFrame(columns=columns)
+        finally:
+            release_db_connection(conn)
+
+    df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    for name, type_code in zip(columns, type_codes):
+        if type_code == TIMESTAMP_OID:
+            df[name] = pd.to_datetime(df[name], format="ISO8601")
+        elif type_code in psycopg2.extensions.DECIMAL.values:
+            df[name] = df[name].astype("float64")
+    for name in categorical:
+        if len(df) and df[name].nunique() <= CATEGORY_MAX_RATIO * len(df):
+            df[name] = df[name].astype("category")
+    return df
+
+
+STREAM_ITERSIZE = 2000
+
+
+def run_query_stream(query, values=None, itersize=STREAM_ITERSIZE):
+    """
+    Executa uma consulta de leitura (SELECT) em um cursor nomeado (server-side)
+    e devolve as linhas em lotes de até `itersize`, sem materializar o resultado inteiro.
+    A conexão volta ao pool quando o gerador termina ou é descartado.
+    Uma falha, mesmo depois de alguns lotes entregues, levanta QueryError para
+    que quem consome não trate um resultado parcial como completo.
     """
     conn = get_db_connection()
     if conn is None:
-        return []
+        raise QueryError("Sem conexão com o banco de dados.")
     try:
-        with conn.cursor() as cursor:
+        with conn.cursor(name=f"stream_{threading.get_ident()}_{time.monotonic_ns()}") as cursor:
+            cursor.itersize = itersize
             cursor.execute(query, values or ())
-            return cursor.fetchall()
+            while True:
+                batch = cursor.fetchmany(itersize)
+                if not batch:
+                    break
+                yield batch
+        conn.commit()
+        _record_db_success()
     except Exception as e:
-        conn.rollback()
-        st.error(f"Erro ao executar a consulta: {e}")
-        return []
+        if _is_transient_db_error(e):
+            _record_db_failure()
+        raise QueryError(str(e)) from e
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+
+def run_query_chunks(query, columns, values=None, itersize=STREAM_ITERSIZE):
+    """
+    Variante de run_query_stream que entrega cada lote como um DataFrame.
+    """
+    for batch in run_query_stream(query, values, itersize):
+        yield pd.DataFrame(batch, columns=columns)
 
 
 def run_insert(query, values):
     """
     Executa uma consulta de inserção, atualização ou deleção (INSERT, UPDATE ou DELETE).
-    Abre e fecha a conexão a cada chamada.
     """
+    return _run_write(lambda conn, cursor: cursor.execute(query, values))
+
+
+def run_prepared_insert(name, values):
+    """
+    Igual a run_insert, mas executa a consulta preparada `name` do PREPARED_QUERIES.
+    """
+    return _run_write(lambda conn, cursor: execute_prepared(conn, cursor, name, values))
+
+
+def _run_write(execute):
     conn = get_db_connection()
     if conn is None:
         return False
     try:
         with conn.cursor() as cursor:
-            cursor.execute(query, values)
+            execute(conn, cursor)
         conn.commit()
+        _record_db_success()
+        request_home_snapshot_refresh()
         return True
     except Exception as e:
-        conn.rollback()
+        if _is_transient_db_error(e):
+            _record_db_failure()
         st.error(f"Erro ao executar a consulta: {e}")
         return False
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 
 #####################
 # CARREGAMENTO DE DADOS
 #####################
-def load_all_data():
+ARCHIVE_AFTER_DAYS = 90
+
+
+def load_all_data(include_archive: bool = False):
     """
     Carrega todos os dados utilizados pelo aplicativo e retorna em um dicionário.
+    Pedidos e estoque vêm apenas das partições quentes, a menos que `include_archive` seja True.
     """
+    archive_filter = "" if include_archive else "WHERE NOT archived "
     data = {}
     try:
-        data["orders"] = run_query(
-            'SELECT "Cliente", "Produto", "Quantidade", "Data", status FROM public.tb_pedido ORDER BY "Data" DESC;'
+        data["orders"] = run_query_df(
+            f'SELECT "Cliente", "Produto", "Quantidade", "Data", status FROM public.tb_pedido {archive_filter}ORDER BY "Data" DESC;',
+            ["Client", "Product", "Quantity", "Date", "Status"],
+            categorical=("Client", "Product", "Status"),
+        )
+        data["products"] = run_query_df(
+            'SELECT supplier, product, quantity, unit_value, total_value, creation_date FROM public.tb_products ORDER BY creation_date DESC;',
+            ["Supplier", "Product", "Quantity", "Unit Value", "Total Value", "Creation Date"],
         )
-        data["products"] = run_query(
-            'SELECT supplier, product, quantity, unit_value, total_value, creation_date FROM public.tb_products ORDER BY creation_date DESC;'
+        data["clients"] = run_query_df(
+            f'SELECT DISTINCT "Cliente" FROM public.tb_pedido {archive_filter}ORDER BY "Cliente";',
+            ["Client"],
         )
-        data["clients"] = run_query('SELECT DISTINCT "Cliente" FROM public.tb_pedido ORDER BY "Cliente";')
-        data["stock"] = run_query(
-            'SELECT "Produto", "Quantidade", "Transação", "Data" FROM public.tb_estoque ORDER BY "Data" DESC;'
+        data["stock"] = run_query_df(
+            f'SELECT "Produto", "Quantidade", "Transação", "Data" FROM public.tb_estoque {archive_filter}ORDER BY "Data" DESC;',
+            ["Product", "Quantity", "Transaction", "Date"],
+            categorical=("Product", "Transaction"),
         )
     except Exception as e:
         st.error(f"Erro ao carregar os dados: {e}")
@@ -124,7 +660,733 @@ def refresh_data():
     """
     Recarrega todos os dados e atualiza o estado da sessão.
     """
-    st.session_state.data = load_all_data()
+    st.session_state.data = load_all_data(include_archive=st.session_state.get("include_archive", False))
+
+
+def include_archive_checkbox(key: str):
+    """
+    Checkbox para incluir os registros arquivados em Orders e Stock.
+    A escolha vale para a sessão inteira e recarrega os dados ao ser alterada.
+    """
+    def _on_change():
+        st.session_state.include_archive = st.session_state[key]
+        refresh_data()
+
+    st.checkbox(
+        "Include archived records",
+        value=st.session_state.get("include_archive", False),
+        key=key,
+        on_change=_on_change,
+    )
+
+
+def run_history_maintenance():
+    """
+    Cria as partições mensais de tb_pedido/tb_estoque e arquiva pedidos pagos e
+    registros de estoque com mais de ARCHIVE_AFTER_DAYS dias (ver sql/001_particionar_historico.sql).
+    O arquivamento pode passar do statement_timeout das conexões do pool, por isso
+    o limite é desligado só nesta transação (SET LOCAL).
+    """
+    def execute(conn, cursor):
+        cursor.execute("SET LOCAL statement_timeout = 0;")
+        cursor.execute("SELECT public.fn_manutencao_historico(%s::interval);", (f"{ARCHIVE_AFTER_DAYS} days",))
+
+    return _run_write(execute)
+
+
+#####################
+# EVENTOS E SNAPSHOTS DE PEDIDOS
+#####################
+ORDER_SNAPSHOT_INTERVAL_SECONDS = 3600
+ORDER_EVENT_SETTLE_SECONDS = 60
+ORDER_SNAPSHOT_RETENTION_DAYS = 30
+
+
+def apply_order_events(open_tabs: pd.DataFrame, daily_totals: pd.DataFrame, events: pd.DataFrame) -> dict:
+    """
+    Aplica, em ordem, os eventos de tb_pedido_evento sobre as comandas em aberto
+    (chave Cliente/Produto/Data) e os totais diários (chave Dia/Produto/status).
+    Totais que chegam a zero são mantidos, para que um snapshot que regrava um
+    dia substitua também as linhas que deixaram de existir.
+    """
+    tabs = defaultdict(int)
+    for client, product, timestamp, quantity in zip(
+        open_tabs["Cliente"], open_tabs["Produto"], open_tabs["Data"], open_tabs["Quantidade"]
+    ):
+        tabs[(client, product, timestamp)] += int(quantity)
+    daily = defaultdict(int)
+    for day, product, status, quantity in zip(
+        daily_totals["Dia"], daily_totals["Produto"], daily_totals["status"], daily_totals["Quantidade"]
+    ):
+        daily[(day, product, status)] += int(quantity)
+
+    for event in events.itertuples(index=False):
+        previous = event.anterior or {}
+        quantity = int(event.Quantidade)
+        day = event.Data.date()
+        key = (event.Cliente, event.Produto, event.Data)
+
+        if event.tipo == "created":
+            tabs[key] += quantity
+        elif event.tipo == "paid":
+            tabs.pop((event.Cliente, event.Produto, pd.Timestamp(previous["Data"])), None)
+            daily[(day, event.Produto, event.status)] += quantity
+        elif event.tipo == "edited":
+            tabs.pop((event.Cliente, previous["Produto"], event.Data), None)
+            if previous["status"] != 'em aberto':
+                daily[(day, previous["Produto"], previous["status"])] -= previous["Quantidade"]
+            if event.status == 'em aberto':
+                tabs[key] += quantity
+            else:
+                daily[(day, event.Produto, event.status)] += quantity
+        elif event.tipo == "deleted":
+            tabs.pop(key, None)
+            if event.status != 'em aberto':
+                daily[(day, event.Produto, event.status)] -= quantity
+
+    return {
+        "open_tabs": pd.DataFrame(
+            [(*key, quantity) for key, quantity in tabs.items() if quantity > 0],
+            columns=["Cliente", "Produto", "Data", "Quantidade"],
+        ),
+        "daily_totals": pd.DataFrame(
+            [(*key, quantity) for key, quantity in daily.items()],
+            columns=["Dia", "Produto", "status", "Quantidade"],
+        ),
+    }
+
+
+def load_order_state(at: datetime = None, days=None) -> dict:
+    """
+    Reconstrói as comandas em aberto e os totais diários no instante `at`
+    (padrão: agora) a partir do snapshot mais recente até `at` e dos eventos
+    posteriores a ele. Retorna None se não houver snapshot até `at`.
+    `at` é comparado com colunas timestamptz: instantes sem fuso são tratados
+    como horário local do servidor do aplicativo.
+
+    Cada snapshot grava só os dias alterados desde o anterior, então os totais de
+    um dia vêm do snapshot mais recente que o contém. Só são lidos e devolvidos
+    os dias em `days` (padrão: os dias alterados pelos eventos aplicados).
+    Levanta QueryError se o banco falhar, para não gravar um snapshot incompleto.
+    """
+    at = (at or datetime.now()).astimezone()
+    snapshot = run_query_df(
+        'SELECT id, ultimo_evento_id FROM public.tb_snapshot_pedido '
+        'WHERE gerado_em <= %s ORDER BY gerado_em DESC LIMIT 1;',
+        ["id", "ultimo_evento_id"],
+        (at,),
+        raise_errors=True,
+    )
+    if snapshot.empty:
+        return None
+    snapshot_id = int(snapshot["id"].iloc[0])
+    last_event_id = int(snapshot["ultimo_evento_id"].iloc[0])
+
+    open_tabs = run_query_df(
+        'SELECT "Cliente", "Produto", "Data", "Quantidade" FROM public.tb_snapshot_comanda WHERE snapshot_id = %s;',
+        ["Cliente", "Produto", "Data", "Quantidade"],
+        (snapshot_id,),
+        raise_errors=True,
+    )
+    events = run_query_df(
+        'SELECT id, tipo, "Cliente", "Produto", "Quantidade", "Data", status, anterior '
+        'FROM public.tb_pedido_evento WHERE id > %s AND ocorrido_em <= %s ORDER BY id;',
+        ["id", "tipo", "Cliente", "Produto", "Quantidade", "Data", "status", "anterior"],
+        (last_event_id, at),
+        raise_errors=True,
+    )
+    if days is None:
+        days = sorted({timestamp.date() for timestamp in events["Data"]})
+    days = list(days)
+    daily_totals = run_query_df(
+        """
+        SELECT t.dia, t."Produto", t.status, t."Quantidade"
+        FROM public.tb_snapshot_total_diario t
+        JOIN (
+            SELECT dia, max(snapshot_id) AS snapshot_id
+            FROM public.tb_snapshot_total_diario
+            WHERE dia = ANY(%s::date[]) AND snapshot_id <= %s
+            GROUP BY dia
+        ) ultimo USING (dia, snapshot_id);
+        """,
+        ["Dia", "Produto", "status", "Quantidade"],
+        (days, snapshot_id),
+        raise_errors=True,
+    )
+
+    state = apply_order_events(open_tabs, daily_totals, events)
+    state["daily_totals"] = state["daily_totals"][state["daily_totals"]["Dia"].isin(days)]
+    state["days"] = days
+    state["at"] = at
+    state["events_applied"] = len(events)
+    state["last_event_id"] = int(events["id"].max()) if not events.empty else last_event_id
+    return state
+
+
+def take_order_snapshot() -> bool:
+    """
+    Grava um novo snapshot calculado a partir do snapshot anterior e dos eventos
+    seguintes, sem reler tb_pedido. Só entram eventos com mais de
+    ORDER_EVENT_SETTLE_SECONDS, para não pular transações ainda não confirmadas.
+    As comandas em aberto são gravadas inteiras; os totais diários, só dos dias
+    alterados por esses eventos.
+    """
+    at = datetime.now().astimezone() - timedelta(seconds=ORDER_EVENT_SETTLE_SECONDS)
+    state = load_order_state(at)
+    if state is None or state["events_applied"] == 0:
+        return False
+
+    open_tabs = state["open_tabs"]
+    daily_totals = state["daily_totals"]
+    query = """
+    WITH snap AS (
+        INSERT INTO public.tb_snapshot_pedido (gerado_em, ultimo_evento_id)
+        VALUES (%s, %s)
+        RETURNING id
+    ),
+    comandas AS (
+        INSERT INTO public.tb_snapshot_comanda (snapshot_id, "Cliente", "Produto", "Data", "Quantidade")
+        SELECT snap.id, c.* FROM snap, unnest(%s::text[], %s::text[], %s::timestamp[], %s::integer[]) AS c
+    )
+    INSERT INTO public.tb_snapshot_total_diario (snapshot_id, dia, "Produto", status, "Quantidade")
+    SELECT snap.id, d.* FROM snap, unnest(%s::date[], %s::text[], %s::text[], %s::integer[]) AS d;
+    """
+    return run_insert(query, (
+        at, state["last_event_id"],
+        open_tabs["Cliente"].tolist(), open_tabs["Produto"].tolist(),
+        [ts.to_pydatetime() for ts in open_tabs["Data"]], open_tabs["Quantidade"].tolist(),
+        daily_totals["Dia"].tolist(), daily_totals["Produto"].tolist(),
+        daily_totals["status"].tolist(), daily_totals["Quantidade"].tolist(),
+    ))
+
+
+def prune_order_snapshots() -> bool:
+    """
+    Apaga os snapshots com mais de ORDER_SNAPSHOT_RETENTION_DAYS dias, exceto o
+    mais recente deles, que passa a ser a base das reconstruções. Antes, os totais
+    diários mais recentes de cada dia que só existiam nos snapshots apagados são
+    movidos para essa base. Instantes anteriores a ela deixam de ser reconstruíveis.
+    """
+    cutoff = "(SELECT max(id) FROM public.tb_snapshot_pedido WHERE gerado_em < now() - %s::interval)"
+    retention = f"{ORDER_SNAPSHOT_RETENTION_DAYS} days"
+
+    def execute(conn, cursor):
+        cursor.execute(
+            f"""
+            UPDATE public.tb_snapshot_total_diario t
+            SET snapshot_id = {cutoff}
+            FROM (
+                SELECT dia, max(snapshot_id) AS snapshot_id
+                FROM public.tb_snapshot_total_diario
+                WHERE snapshot_id <= {cutoff}
+                GROUP BY dia
+            ) ultimo
+            WHERE t.dia = ultimo.dia AND t.snapshot_id = ultimo.snapshot_id
+              AND ultimo.snapshot_id < {cutoff};
+            """,
+            (retention, retention, retention),
+        )
+        cursor.execute(f"DELETE FROM public.tb_snapshot_pedido WHERE id < {cutoff};", (retention,))
+
+    return _run_write(execute)
+
+
+#####################
+# CUBO DE VENDAS (ANALYTICS)
+#####################
+PAYMENT_STATUSES = ["Received - Debited", "Received - Credit", "Received - Pix", "Received - Cash"]
+WEEKDAY_LABELS = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
+CUBE_DIMENSIONS = ["Produto", "Hora", "DiaSemana", "status"]
+CUBE_MEASURES = ["Quantidade", "Total", "Pedidos"]
+CUBE_OVERLAP = timedelta(minutes=5)
+CUBE_REFRESH_INTERVAL_SECONDS = 300
+
+
+def _empty_sales_cube() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "Produto": pd.Series(dtype="object"),
+            "Hora": pd.Series(dtype="int8"),
+            "DiaSemana": pd.Series(dtype="int8"),
+            "status": pd.Series(dtype="object"),
+            "Quantidade": pd.Series(dtype="int64"),
+            "Total": pd.Series(dtype="float64"),
+            "Pedidos": pd.Series(dtype="int64"),
+        }
+    )
+
+
+@process_singleton
+def get_sales_cube():
+    """
+    Retorna o cubo de vendas compartilhado pelo processo.
+    O cubo guarda as vendas já recebidas agregadas por produto, hora do dia,
+    dia da semana e forma de pagamento, junto com a marca d'água ("Data" mais
+    recente já incorporada) usada nas atualizações incrementais.
+    """
+    return {"cube": _empty_sales_cube(), "watermark": None, "seen": {}, "updated_at": None, "lock": threading.Lock()}
+
+
+def aggregate_sales_rows(rows) -> pd.DataFrame:
+    """
+    Agrega linhas (Cliente, Produto, Quantidade, total, status, Data) de
+    vw_pedido_produto nas dimensões do cubo.
+    """
+    if not rows:
+        return _empty_sales_cube()
+    df = pd.DataFrame(rows, columns=["Cliente", "Produto", "Quantidade", "total", "status", "Data"])
+    timestamps = pd.to_datetime(df["Data"])
+    df["Hora"] = timestamps.dt.hour.astype("int8")
+    df["DiaSemana"] = timestamps.dt.dayofweek.astype("int8")
+    df["Quantidade"] = df["Quantidade"].astype("int64")
+    df["Total"] = df["total"].astype("float64")
+    df["Pedidos"] = 1
+    return df.groupby(CUBE_DIMENSIONS, as_index=False, sort=False)[CUBE_MEASURES].sum()
+
+
+def update_sales_cube(full_rebuild: bool = False) -> dict:
+    """
+    Incorpora ao cubo os pedidos recebidos a partir da marca d'água menos
+    CUBE_OVERLAP. Como process_payment grava CURRENT_TIMESTAMP (início da
+    transação) em "Data", um pagamento pode ser confirmado depois de linhas com
+    "Data" maior já lidas; a janela de sobreposição relê esse trecho e as linhas
+    já contadas nele (guardadas em "seen") são descartadas.
+    Edições e exclusões de pedidos já pagos só são refletidas com full_rebuild=True.
+    O estado só é trocado depois que a leitura termina sem erro; se o stream
+    falhar, a QueryError sobe e o cubo e a marca d'água anteriores são mantidos.
+    """
+    state = get_sales_cube()
+    with state["lock"]:
+        if full_rebuild:
+            cube, watermark, seen = _empty_sales_cube(), None, {}
+        else:
+            cube, watermark, seen = state["cube"], state["watermark"], state["seen"]
+
+        query = (
+            'SELECT "Cliente", "Produto", "Quantidade", "total", status, "Data" '
+            'FROM public.vw_pedido_produto '
+            'WHERE status = ANY(%s)'
+        )
+        values = [PAYMENT_STATUSES]
+        if watermark is not None:
+            query += ' AND "Data" >= %s'
+            values.append(watermark - CUBE_OVERLAP)
+
+        # Agrega lote a lote: na reconstrução completa a memória fica limitada
+        # ao tamanho do lote (mais as linhas da janela de sobreposição).
+        partials = [cube]
+        fetched = defaultdict(int)
+        recent = []
+        new_watermark = watermark
+        for rows in run_query_stream(query + ";", tuple(values)):
+            batch_max = max(row[5] for row in rows)
+            new_watermark = batch_max if new_watermark is None else max(new_watermark, batch_max)
+            recent.extend(row for row in rows if row[5] >= new_watermark - CUBE_OVERLAP)
+            if seen:
+                fresh = []
+                for row in rows:
+                    fetched[row] += 1
+                    if fetched[row] > seen.get(row, 0):
+                        fresh.append(row)
+                rows = fresh
+            partials.append(aggregate_sales_rows(rows))
+
+        if new_watermark is not None:
+            window_start = new_watermark - CUBE_OVERLAP
+            seen = defaultdict(int)
+            for row in recent:
+                if row[5] >= window_start:
+                    seen[row] += 1
+            seen = dict(seen)
+
+        state["cube"] = (
+            pd.concat(partials, ignore_index=True)
+            .groupby(CUBE_DIMENSIONS, as_index=False, sort=False)[CUBE_MEASURES]
+            .sum()
+        )
+        state["watermark"] = new_watermark
+        state["seen"] = seen
+        state["updated_at"] = datetime.now()
+    return state
+
+
+def sales_cube_is_stale(state: dict) -> bool:
+    return state["updated_at"] is None or (
+        (datetime.now() - state["updated_at"]).total_seconds() >= CUBE_REFRESH_INTERVAL_SECONDS
+    )
+
+
+def slice_sales_cube(cube: pd.DataFrame, products=None, statuses=None, weekdays=None, hours=None) -> pd.DataFrame:
+    """
+    Filtra o cubo pelas dimensões informadas (None = todas) usando máscaras vetorizadas.
+    """
+    mask = np.ones(len(cube), dtype=bool)
+    if products:
+        mask &= cube["Produto"].isin(products).to_numpy()
+    if statuses:
+        mask &= cube["status"].isin(statuses).to_numpy()
+    if weekdays is not None:
+        mask &= cube["DiaSemana"].isin(weekdays).to_numpy()
+    if hours is not None:
+        mask &= cube["Hora"].isin(hours).to_numpy()
+    return cube[mask]
+
+
+#####################
+# RELATÓRIO DE FECHAMENTO DIÁRIO
+#####################
+REPORTS_DIR = "reports"
+CLOSING_HOUR = 23
+REPORT_GENERATED_AT_FILE = "generated_at.txt"
+REPORT_CHECK_INTERVAL_SECONDS = 300
+REPORT_TABLES = {
+    "payments": "Vendas por Forma de Pagamento",
+    "products": "Vendas por Produto",
+    "open_tabs": "Comandas em Aberto (no momento da geração)",
+    "stock": "Movimentação de Estoque",
+}
+
+
+def build_daily_report(report_date: date) -> dict:
+    """
+    Calcula o relatório de fechamento de um dia: vendas por forma de pagamento,
+    vendas por produto, comandas em aberto e movimentação de estoque.
+    Os pedidos do dia e as comandas abertas vêm de uma única consulta; as comandas
+    são as abertas no momento da geração (`generated_at`), não no fechamento do dia.
+    Levanta QueryError se o banco falhar, para não gravar um relatório zerado.
+    """
+    generated_at = datetime.now()
+    orders_query = """
+    SELECT "Cliente", "Produto", "Quantidade", "total", status
+    FROM public.vw_pedido_produto
+    WHERE status = %s OR DATE("Data") = %s;
+    """
+    df_orders = run_query_df(
+        orders_query,
+        ["Cliente", "Produto", "Quantidade", "total", "status"],
+        ('em aberto', report_date),
+        raise_errors=True,
+    )
+
+    open_mask = df_orders["status"] == "em aberto"
+    df_sold = df_orders[~open_mask]
+    df_open = df_orders[open_mask]
+
+    payments = (
+        df_sold.groupby("status", as_index=False)["total"].sum()
+        .rename(columns={"status": "Payment", "total": "Total"})
+    )
+    products = (
+        df_sold.groupby("Produto", as_index=False)[["Quantidade", "total"]].sum()
+        .rename(columns={"Produto": "Product", "Quantidade": "Quantity", "total": "Total"})
+        .sort_values("Total", ascending=False)
+    )
+    open_tabs = (
+        df_open.groupby("Cliente", as_index=False)["total"].sum()
+        .rename(columns={"Cliente": "Client", "total": "Total"})
+        .sort_values("Total", ascending=False)
+    )
+
+    stock_query = """
+    SELECT "Produto", "Transação", SUM("Quantidade")
+    FROM public.tb_estoque
+    WHERE DATE("Data") = %s
+    GROUP BY "Produto", "Transação"
+    ORDER BY "Produto";
+    """
+    stock = run_query_df(stock_query, ["Product", "Transaction", "Quantity"], (report_date,), raise_errors=True)
+
+    return {
+        "date": report_date,
+        "generated_at": generated_at,
+        "payments": payments,
+        "products": products,
+        "open_tabs": open_tabs,
+        "stock": stock,
+    }
+
+
+def render_daily_report_text(report: dict) -> str:
+    """
+    Gera o texto do relatório de fechamento no mesmo formato da nota fiscal.
+    """
+    lines = []
+    lines.append("==================================================")
+    lines.append("              FECHAMENTO DO DIA                  ")
+    lines.append("==================================================")
+    lines.append("Empresa: Boituva Beach Club")
+    lines.append(f"Data: {report['date'].strftime('%d/%m/%Y')}")
+    lines.append(f"Gerado em: {report['generated_at'].strftime('%d/%m/%Y %H:%M')}")
+    lines.append("--------------------------------------------------")
+    lines.append("FORMA DE PAGAMENTO                 TOTAL")
+    lines.append("--------------------------------------------------")
+    for payment, total in zip(report["payments"]["Payment"], format_currency_series(report["payments"]["Total"])):
+        lines.append(f"{payment[:30]:<30} {total:>15}")
+    lines.append(f"{'TOTAL RECEBIDO:':>30} {format_currency(report['payments']['Total'].sum()):>15}")
+    lines.append("--------------------------------------------------")
+    lines.append("PRODUTO               QTD     TOTAL")
+    lines.append("--------------------------------------------------")
+    products = report["products"]
+    for product, quantity, total in zip(products["Product"], products["Quantity"], format_currency_series(products["Total"])):
+        lines.append(f"{product[:20]:<20} {int(quantity):>5} {total}")
+    lines.append("--------------------------------------------------")
+    lines.append(f"COMANDAS EM ABERTO EM {report['generated_at'].strftime('%d/%m %H:%M')}   TOTAL")
+    lines.append("--------------------------------------------------")
+    for client, total in zip(report["open_tabs"]["Client"], format_currency_series(report["open_tabs"]["Total"])):
+        lines.append(f"{client[:30]:<30} {total:>15}")
+    lines.append(f"{'TOTAL EM ABERTO:':>30} {format_currency(report['open_tabs']['Total'].sum()):>15}")
+    lines.append("--------------------------------------------------")
+    lines.append("ESTOQUE               TIPO      QTD")
+    lines.append("--------------------------------------------------")
+    for _, row in report["stock"].iterrows():
+        lines.append(f"{row['Product'][:20]:<20} {row['Transaction'][:8]:<8} {int(row['Quantity']):>5}")
+    lines.append("==================================================")
+    return "\n".join(lines)
+
+
+def report_path(report_date: date) -> str:
+    return os.path.join(REPORTS_DIR, report_date.strftime("%Y-%m-%d"))
+
+
+def save_daily_report(report: dict) -> str:
+    """
+    Grava o relatório como artefatos em disco (um CSV por tabela e o texto renderizado).
+    Os arquivos são escritos num diretório temporário e só então renomeados para o
+    lugar definitivo, substituindo a versão anterior de uma vez.
+    """
+    path = report_path(report["date"])
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=REPORTS_DIR)
+    try:
+        for name in REPORT_TABLES:
+            report[name].to_csv(os.path.join(tmp_path, f"{name}.csv"), index=False)
+        with open(os.path.join(tmp_path, "report.txt"), "w", encoding="utf-8") as f:
+            f.write(render_daily_report_text(report))
+        with open(os.path.join(tmp_path, REPORT_GENERATED_AT_FILE), "w", encoding="utf-8") as f:
+            f.write(report["generated_at"].isoformat())
+        if os.path.exists(path):
+            old_path = tempfile.mkdtemp(prefix=".old-", dir=REPORTS_DIR)
+            os.replace(path, os.path.join(old_path, "report"))
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return path
+
+
+def generate_daily_report(report_date: date) -> str:
+    return save_daily_report(build_daily_report(report_date))
+
+
+def report_closing_hour() -> int:
+    """
+    Hora a partir da qual o relatório do dia é gerado; pode ser definida em
+    st.secrets["reports"]["closing_hour"].
+    """
+    return int(st.secrets.get("reports", {}).get("closing_hour", CLOSING_HOUR))
+
+
+def daily_report_generated_at(report_date: date):
+    """
+    Horário em que o relatório arquivado de `report_date` foi gerado, ou None se
+    ele não existir (ou for de uma versão que não registrava o horário).
+    """
+    try:
+        with open(os.path.join(report_path(report_date), REPORT_GENERATED_AT_FILE), encoding="utf-8") as f:
+            return datetime.fromisoformat(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def report_needs_generation(report_date: date, now: datetime) -> bool:
+    """
+    O relatório precisa ser (re)gerado se ainda não existe ou se foi gerado antes
+    do fim do dia e o dia já terminou: comandas fechadas entre o horário de
+    fechamento e a meia-noite também contam para aquele dia.
+    """
+    generated_at = daily_report_generated_at(report_date)
+    if generated_at is None:
+        return True
+    day_end = datetime.combine(report_date + timedelta(days=1), datetime.min.time())
+    return now >= day_end and generated_at < day_end
+
+
+def load_daily_report(report_date: date) -> dict:
+    """
+    Lê um relatório já arquivado, sem consultar o banco.
+    """
+    path = report_path(report_date)
+    report = {"date": report_date}
+    for name in REPORT_TABLES:
+        report[name] = pd.read_csv(os.path.join(path, f"{name}.csv"))
+    with open(os.path.join(path, "report.txt"), encoding="utf-8") as f:
+        report["text"] = f.read()
+    return report
+
+
+def list_daily_reports() -> list:
+    if not os.path.isdir(REPORTS_DIR):
+        return []
+    return sorted(
+        (datetime.strptime(name, "%Y-%m-%d").date() for name in os.listdir(REPORTS_DIR)
+         if not name.startswith(".") and os.path.exists(os.path.join(REPORTS_DIR, name, "report.txt"))),
+        reverse=True,
+    )
+
+
+def _report_scheduler_loop():
+    last_maintenance = None
+    last_order_snapshot = None
+    while True:
+        now = datetime.now()
+        if last_maintenance != now.date():
+            try:
+                if run_history_maintenance():
+                    last_maintenance = now.date()
+                else:
+                    logger.error("Manutenção do histórico falhou; nova tentativa em %s s.", REPORT_CHECK_INTERVAL_SECONDS)
+            except Exception as e:
+                logger.exception("Erro na manutenção do histórico: %s", e)
+        if last_order_snapshot is None or (now - last_order_snapshot).total_seconds() >= ORDER_SNAPSHOT_INTERVAL_SECONDS:
+            try:
+                take_order_snapshot()
+                prune_order_snapshots()
+                last_order_snapshot = now
+            except Exception as e:
+                logger.exception("Erro ao gravar o snapshot de pedidos: %s", e)
+        pending = [now.date() - timedelta(days=1)]
+        try:
+            if now.hour >= report_closing_hour():
+                pending.append(now.date())
+        except Exception as e:
+            logger.exception("Horário de fechamento inválido em st.secrets: %s", e)
+        for report_date in pending:
+            if report_needs_generation(report_date, now):
+                try:
+                    generate_daily_report(report_date)
+                except Exception as e:
+                    logger.exception("Erro ao gerar o relatório de %s: %s", report_date, e)
+        time.sleep(REPORT_CHECK_INTERVAL_SECONDS)
+
+
+@process_singleton
+def start_report_scheduler():
+    """
+    Inicia (uma vez por processo) a tarefa em segundo plano que gera o relatório
+    do dia após o horário de fechamento e o do dia anterior, caso esteja faltando
+    ou tenha sido gerado antes da meia-noite,
+    executa uma vez por dia a manutenção das partições do histórico e grava os
+    snapshots de pedidos a cada ORDER_SNAPSHOT_INTERVAL_SECONDS.
+    """
+    thread = threading.Thread(target=_report_scheduler_loop, name="daily-report-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+#####################
+# RESUMO DA HOME EM SEGUNDO PLANO
+#####################
+HOME_SNAPSHOT_INTERVAL_SECONDS = 60
+
+
+def compute_home_snapshot() -> dict:
+    """
+    Executa as três consultas de resumo da Home (comandas abertas, pedidos
+    fechados por dia e estoque vs. pedidos) e devolve os DataFrames com o horário do cálculo.
+    Levanta QueryError se qualquer consulta falhar, para não publicar um resumo vazio.
+    """
+    stock_vs_orders_query = """
+        SELECT product, stock_quantity, orders_quantity, total_in_stock
+        FROM public.vw_stock_vs_orders_summary
+    """
+    return {
+        "open_orders": run_prepared_df(
+            "open_orders_summary", ["Client", "Total"], ('em aberto',), raise_errors=True
+        ),
+        "closed_orders": run_prepared_df(
+            "closed_orders_summary", ["Date", "Total"], ('em aberto',), raise_errors=True
+        ),
+        "stock_vs_orders": run_query_df(
+            stock_vs_orders_query,
+            ["Product", "Stock_Quantity", "Orders_Quantity", "Total_in_Stock"],
+            raise_errors=True,
+        ),
+        "computed_at": datetime.now(),
+        "error": None,
+    }
+
+
+def _home_snapshot_loop(worker: dict):
+    while True:
+        worker["wake"].clear()
+        try:
+            _store_home_snapshot(worker, compute_home_snapshot())
+        except Exception as e:
+            logger.exception("Erro ao atualizar o resumo da Home: %s", e)
+            _mark_home_snapshot_stale(worker, e)
+        worker["wake"].wait(HOME_SNAPSHOT_INTERVAL_SECONDS)
+
+
+def _store_home_snapshot(worker: dict, snapshot: dict):
+    with worker["lock"]:
+        worker["snapshot"] = snapshot
+
+
+def _mark_home_snapshot_stale(worker: dict, error: Exception):
+    """
+    Mantém o último resumo calculado, marcando-o com o erro da tentativa que falhou.
+    """
+    with worker["lock"]:
+        if worker["snapshot"] is not None:
+            worker["snapshot"] = {**worker["snapshot"], "error": str(error)}
+        return worker["snapshot"]
+
+
+@process_singleton
+def get_home_snapshot_worker():
+    """
+    Inicia (uma vez por processo) a tarefa que recalcula o resumo da Home a cada
+    HOME_SNAPSHOT_INTERVAL_SECONDS ou quando acordada após uma gravação.
+    O último resumo fica em memória, compartilhado por todas as sessões.
+    """
+    worker = {"snapshot": None, "lock": threading.Lock(), "wake": threading.Event()}
+    worker["thread"] = threading.Thread(
+        target=_home_snapshot_loop, args=(worker,), name="home-snapshot-worker", daemon=True
+    )
+    worker["thread"].start()
+    return worker
+
+
+def get_home_snapshot():
+    worker = get_home_snapshot_worker()
+    with worker["lock"]:
+        return worker["snapshot"]
+
+
+def refresh_home_snapshot() -> dict:
+    """
+    Recalcula o resumo da Home imediatamente (na sessão atual) e o publica para as demais.
+    Se o banco falhar, devolve o último resumo marcado como desatualizado (ou None).
+    """
+    worker = get_home_snapshot_worker()
+    try:
+        snapshot = compute_home_snapshot()
+    except QueryError as e:
+        return _mark_home_snapshot_stale(worker, e)
+    _store_home_snapshot(worker, snapshot)
+    return snapshot
+
+
+def request_home_snapshot_refresh():
+    """
+    Acorda a tarefa em segundo plano para recalcular o resumo da Home.
+    Pode ser chamada de qualquer thread (inclusive do agendador de relatórios):
+    o worker é único no processo.
+    """
+    get_home_snapshot_worker()["wake"].set()
 
 
 #####################
@@ -138,8 +1400,8 @@ def sidebar_navigation():
         st.title("Boituva Beach Club 🎾")
         selected = option_menu(
             "Menu Principal",
-            ["Home", "Orders", "Products", "Stock", "Clients", "Nota Fiscal"],
-            icons=["house", "file-text", "box", "list-task", "layers", "receipt"],
+            ["Home", "Orders", "Products", "Stock", "Clients", "Nota Fiscal", "Analytics", "Relatórios"],
+            icons=["house", "file-text", "box", "list-task", "layers", "receipt", "bar-chart", "archive"],
             menu_icon="cast",
             default_index=0,
             styles={
@@ -158,6 +1420,19 @@ def sidebar_navigation():
     return selected
 
 
+def render_db_status():
+    """
+    Mostra no menu lateral o estado do disjuntor do banco de dados.
+    """
+    remaining = db_breaker_remaining()
+    if remaining > 0:
+        st.error(f"🔌 Banco indisponível — consultas suspensas por {remaining:.0f} s.")
+    else:
+        failures = get_db_breaker()["failures"]
+        if failures:
+            st.warning(f"⚠️ Banco instável: {failures} falha(s) recente(s).")
+
+
 #####################
 # PÁGINA HOME
 #####################
@@ -167,61 +1442,55 @@ def home_page():
 
     # Apenas admin vê as informações de resumo
     if st.session_state.get("username") == "admin":
+        col_info, col_refresh = st.columns([3, 1])
+        with col_refresh:
+            refresh_now = st.button("Atualizar agora", key="home_refresh_button")
+
+        snapshot = get_home_snapshot()
+        if refresh_now or snapshot is None:
+            snapshot = refresh_home_snapshot()
+        if snapshot is None:
+            st.error("Não foi possível calcular o resumo: banco de dados indisponível.")
+            return
+        with col_info:
+            st.caption(f"Resumo calculado em {snapshot['computed_at'].strftime('%Y-%m-%d %H:%M:%S')}")
+        if snapshot["error"]:
+            st.warning(
+                "O banco de dados não respondeu na última atualização; exibindo o resumo de "
+                f"{snapshot['computed_at'].strftime('%Y-%m-%d %H:%M:%S')}. Erro: {snapshot['error']}"
+            )
+
         st.markdown("**Open Orders Summary**")
-        open_orders_query = """
-        SELECT "Cliente", SUM("total") as Total
-        FROM public.vw_pedido_produto
-        WHERE status = %s
-        GROUP BY "Cliente"
-        ORDER BY "Cliente" DESC;
-        """
-        open_orders_data = run_query(open_orders_query, ('em aberto',))
-        if open_orders_data:
-            df_open_orders = pd.DataFrame(open_orders_data, columns=["Client", "Total"])
+        df_open_orders = snapshot["open_orders"].copy()
+        if not df_open_orders.empty:
             total_open = df_open_orders["Total"].sum()
-            df_open_orders["Total_display"] = df_open_orders["Total"].apply(format_currency)
-            st.table(df_open_orders[["Client", "Total_display"]])
+            df_open_orders["Total_display"] = format_currency_series(df_open_orders["Total"])
+            render_bounded_table(df_open_orders[["Client", "Total_display"]], key="home_open_orders")
             st.markdown(f"**Total Geral (Open Orders):** {format_currency(total_open)}")
         else:
             st.info("Nenhum pedido em aberto encontrado.")
 
         st.markdown("**Closed Orders Summary**")
-        closed_orders_query = """
-        SELECT DATE("Data") as Date, SUM("total") as Total
-        FROM public.vw_pedido_produto
-        WHERE status != %s
-        GROUP BY DATE("Data")
-        ORDER BY DATE("Data") DESC;
-        """
-        closed_orders_data = run_query(closed_orders_query, ('em aberto',))
-        if closed_orders_data:
-            df_closed_orders = pd.DataFrame(closed_orders_data, columns=["Date", "Total"])
+        df_closed_orders = snapshot["closed_orders"].copy()
+        if not df_closed_orders.empty:
             total_closed = df_closed_orders["Total"].sum()
-            df_closed_orders["Total_display"] = df_closed_orders["Total"].apply(format_currency)
+            df_closed_orders["Total_display"] = format_currency_series(df_closed_orders["Total"])
             df_closed_orders["Date"] = pd.to_datetime(df_closed_orders["Date"]).dt.strftime('%Y-%m-%d')
-            st.table(df_closed_orders[["Date", "Total_display"]])
+            render_bounded_table(df_closed_orders[["Date", "Total_display"]], key="home_closed_orders")
             st.markdown(f"**Total Geral (Closed Orders):** {format_currency(total_closed)}")
         else:
             st.info("Nenhum pedido fechado encontrado.")
 
         st.markdown("**Stock vs. Orders Summary**")
         try:
-            stock_vs_orders_query = """
-                SELECT product, stock_quantity, orders_quantity, total_in_stock
-                FROM public.vw_stock_vs_orders_summary
-            """
-            stock_vs_orders_data = run_query(stock_vs_orders_query)
-            if stock_vs_orders_data:
-                df_stock_vs_orders = pd.DataFrame(
-                    stock_vs_orders_data, 
-                    columns=["Product", "Stock_Quantity", "Orders_Quantity", "Total_in_Stock"]
-                )
+            df_stock_vs_orders = snapshot["stock_vs_orders"].copy()
+            if not df_stock_vs_orders.empty:
 
                 # Exemplo de manipulação
                 df_stock_vs_orders["Total_in_Stock_display"] = df_stock_vs_orders["Total_in_Stock"]
                 df_stock_vs_orders.sort_values("Total_in_Stock", ascending=False, inplace=True)
                 df_display = df_stock_vs_orders[["Product", "Total_in_Stock_display"]]
-                st.table(df_display)
+                render_bounded_table(df_display, key="home_stock_vs_orders")
 
                 total_stock_value = df_stock_vs_orders["Total_in_Stock"].sum()
                 total_stock_value = int(total_stock_value)
@@ -231,6 +1500,13 @@ def home_page():
         except Exception as e:
             st.error(f"Erro ao gerar o resumo Stock vs. Orders: {e}")
 
+        with st.expander("Prepared Queries"):
+            st.caption(
+                f"Planejamento medido com EXPLAIN a cada {PREPARED_PLAN_SAMPLE_EVERY} execuções, "
+                "na forma preparada e no mesmo SQL sem preparar."
+            )
+            st.dataframe(prepared_stats_df(), use_container_width=True)
+
 
 #####################
 # PÁGINA ORDERS
@@ -240,13 +1516,14 @@ def orders_page():
     st.subheader("Register a new order")
 
     search_client = st.text_input("Filtrar por Nome de Cliente (na tabela abaixo):")
+    include_archive_checkbox("orders_include_archive")
 
-    product_data = st.session_state.data.get("products", [])
-    product_list = [""] + [row[1] for row in product_data] if product_data else ["No products available"]
+    df_products = st.session_state.data.get("products", pd.DataFrame())
+    product_list = [""] + df_products["Product"].tolist() if not df_products.empty else ["No products available"]
 
     with st.form(key='order_form'):
-        clientes = run_query('SELECT nome_completo FROM public.tb_clientes ORDER BY nome_completo;')
-        customer_list = [""] + [row[0] for row in clientes]
+        clientes = run_query_df('SELECT nome_completo FROM public.tb_clientes ORDER BY nome_completo;', ["Full Name"])
+        customer_list = [""] + clientes["Full Name"].tolist()
 
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -260,12 +1537,8 @@ def orders_page():
 
     if submit_button:
         if customer_name and product and quantity > 0:
-            query = """
-            INSERT INTO public.tb_pedido ("Cliente", "Produto", "Quantidade", "Data", status)
-            VALUES (%s, %s, %s, %s, 'em aberto');
-            """
             timestamp = datetime.now()
-            success = run_insert(query, (customer_name, product, quantity, timestamp))
+            success = run_prepared_insert("insert_order", (customer_name, product, quantity, timestamp))
             if success:
                 st.success("Order registered successfully!")
                 refresh_data()
@@ -274,11 +1547,10 @@ def orders_page():
         else:
             st.warning("Please fill in all fields correctly.")
 
-    orders_data = st.session_state.data.get("orders", [])
-    if orders_data:
+    df_orders = st.session_state.data.get("orders", pd.DataFrame())
+    if not df_orders.empty:
         st.subheader("All Orders")
-        columns = ["Client", "Product", "Quantity", "Date", "Status"]
-        df_orders = pd.DataFrame(orders_data, columns=columns)
+        df_orders = df_orders.copy()
 
         if search_client:
             df_orders = df_orders[df_orders["Client"].str.contains(search_client, case=False)]
@@ -288,9 +1560,9 @@ def orders_page():
 
         if st.session_state.get("username") == "admin":
             st.subheader("Edit or Delete an Existing Order")
-            df_orders["unique_key"] = df_orders.apply(
-                lambda row: f"{row['Client']}|{row['Product']}|{row['Date'].strftime('%Y-%m-%d %H:%M:%S')}",
-                axis=1
+            df_orders["unique_key"] = (
+                df_orders["Client"].astype(str) + "|" + df_orders["Product"].astype(str) + "|"
+                + df_orders["Date"].dt.strftime('%Y-%m-%d %H:%M:%S')
             )
             unique_keys = df_orders["unique_key"].unique().tolist()
             selected_key = st.selectbox("Select an order to edit/delete:", [""] + unique_keys)
@@ -304,7 +1576,7 @@ def orders_page():
                     original_client = selected_row["Client"]
                     original_product = selected_row["Product"]
                     original_quantity = selected_row["Quantity"]
-                    original_date = selected_row["Date"]
+                    original_date = selected_row["Date"].to_pydatetime()
                     original_status = selected_row["Status"]
 
                     with st.form(key='edit_order_form'):
@@ -318,7 +1590,7 @@ def orders_page():
                         with col2:
                             edit_quantity = st.number_input("Quantity", min_value=1, step=1, value=int(original_quantity))
                         with col3:
-                            edit_status_list = ["em aberto", "Received - Debited", "Received - Credit", "Received - Pix", "Received - Cash"]
+                            edit_status_list = ["em aberto"] + PAYMENT_STATUSES
                             if original_status in edit_status_list:
                                 edit_status_index = edit_status_list.index(original_status)
                             else:
@@ -333,8 +1605,13 @@ def orders_page():
 
                     if delete_button:
                         delete_query = """
-                        DELETE FROM public.tb_pedido
-                        WHERE "Cliente" = %s AND "Produto" = %s AND "Data" = %s;
+                        WITH removido AS (
+                            DELETE FROM public.tb_pedido
+                            WHERE "Cliente" = %s AND "Produto" = %s AND "Data" = %s
+                            RETURNING "Cliente", "Produto", "Quantidade", "Data", status
+                        )
+                        INSERT INTO public.tb_pedido_evento (tipo, "Cliente", "Produto", "Quantidade", "Data", status)
+                        SELECT 'deleted', "Cliente", "Produto", "Quantidade", "Data", status FROM removido;
                         """
                         success = run_insert(delete_query, (original_client, original_product, original_date))
                         if success:
@@ -345,13 +1622,21 @@ def orders_page():
 
                     if update_button:
                         update_query = """
-                        UPDATE public.tb_pedido
-                        SET "Produto" = %s, "Quantidade" = %s, status = %s
-                        WHERE "Cliente" = %s AND "Produto" = %s AND "Data" = %s;
+                        WITH editado AS (
+                            UPDATE public.tb_pedido
+                            SET "Produto" = %s, "Quantidade" = %s, status = %s
+                            WHERE "Cliente" = %s AND "Produto" = %s AND "Data" = %s
+                            RETURNING "Cliente", "Produto", "Quantidade", "Data", status
+                        )
+                        INSERT INTO public.tb_pedido_evento (tipo, "Cliente", "Produto", "Quantidade", "Data", status, anterior)
+                        SELECT 'edited', "Cliente", "Produto", "Quantidade", "Data", status,
+                               jsonb_build_object('Produto', %s::text, 'Quantidade', %s::integer, 'status', %s::text)
+                        FROM editado;
                         """
                         success = run_insert(update_query, (
                             edit_product, edit_quantity, edit_status,
-                            original_client, original_product, original_date
+                            original_client, original_product, original_date,
+                            original_product, int(original_quantity), original_status
                         ))
                         if success:
                             st.success("Order updated successfully!")
@@ -399,20 +1684,19 @@ def products_page():
         else:
             st.warning("Please fill in all fields correctly.")
 
-    products_data = st.session_state.data.get("products", [])
-    if products_data:
+    df_products = st.session_state.data.get("products", pd.DataFrame())
+    if not df_products.empty:
         st.subheader("All Products")
-        columns = ["Supplier", "Product", "Quantity", "Unit Value", "Total Value", "Creation Date"]
-        df_products = pd.DataFrame(products_data, columns=columns)
+        df_products = df_products.copy()
         st.dataframe(df_products, use_container_width=True)
 
         download_df_as_csv(df_products, "products.csv", label="Download Products CSV")
 
         if st.session_state.get("username") == "admin":
             st.subheader("Edit or Delete an Existing Product")
-            df_products["unique_key"] = df_products.apply(
-                lambda row: f"{row['Supplier']}|{row['Product']}|{row['Creation Date'].strftime('%Y-%m-%d')}",
-                axis=1
+            df_products["unique_key"] = (
+                df_products["Supplier"].astype(str) + "|" + df_products["Product"].astype(str) + "|"
+                + pd.to_datetime(df_products["Creation Date"]).dt.strftime('%Y-%m-%d')
             )
             unique_keys = df_products["unique_key"].unique().tolist()
             selected_key = st.selectbox("Select a product to edit/delete:", [""] + unique_keys)
@@ -509,8 +1793,8 @@ Esta página foi projetada para registrar **apenas entradas de produtos no estoq
 Com este sistema, você poderá monitorar todas as adições ao estoque com maior controle e rastreabilidade.  
 """)
 
-    product_data = run_query("SELECT product FROM public.tb_products ORDER BY product;")
-    product_list = [row[0] for row in product_data] if product_data else ["No products available"]
+    product_data = run_query_df("SELECT product FROM public.tb_products ORDER BY product;", ["Product"])
+    product_list = product_data["Product"].tolist() if not product_data.empty else ["No products available"]
 
     with st.form(key='stock_form'):
         col1, col2, col3, col4 = st.columns(4)
@@ -541,20 +1825,20 @@ Com este sistema, você poderá monitorar todas as adições ao estoque com maio
         else:
             st.warning("Please select a product and enter a quantity greater than 0.")
 
-    stock_data = st.session_state.data.get("stock", [])
-    if stock_data:
+    include_archive_checkbox("stock_include_archive")
+    df_stock = st.session_state.data.get("stock", pd.DataFrame())
+    if not df_stock.empty:
         st.subheader("All Stock Records")
-        columns = ["Product", "Quantity", "Transaction", "Date"]
-        df_stock = pd.DataFrame(stock_data, columns=columns)
+        df_stock = df_stock.copy()
         st.dataframe(df_stock, use_container_width=True)
 
         download_df_as_csv(df_stock, "stock.csv", label="Download Stock CSV")
 
         if st.session_state.get("username") == "admin":
             st.subheader("Edit or Delete an Existing Stock Record")
-            df_stock["unique_key"] = df_stock.apply(
-                lambda row: f"{row['Product']}|{row['Transaction']}|{row['Date'].strftime('%Y-%m-%d %H:%M:%S')}",
-                axis=1
+            df_stock["unique_key"] = (
+                df_stock["Product"].astype(str) + "|" + df_stock["Transaction"].astype(str) + "|"
+                + df_stock["Date"].dt.strftime('%Y-%m-%d %H:%M:%S')
             )
             unique_keys = df_stock["unique_key"].unique().tolist()
             selected_key = st.selectbox("Select a stock record to edit/delete:", [""] + unique_keys)
@@ -568,7 +1852,7 @@ Com este sistema, você poderá monitorar todas as adições ao estoque com maio
                     original_product = selected_row["Product"]
                     original_quantity = selected_row["Quantity"]
                     original_transaction = selected_row["Transaction"]
-                    original_date = selected_row["Date"]
+                    original_date = selected_row["Date"].to_pydatetime()
 
                     with st.form(key='edit_stock_form'):
                         col1, col2, col3, col4 = st.columns(4)
@@ -663,16 +1947,16 @@ def clients_page():
         else:
             st.warning("Please fill in the Full Name field.")
 
-    clients_data = run_query(
+    df_clients = run_query_df(
         """SELECT nome_completo, data_nascimento, genero,
                   telefone, email, endereco, data_cadastro
            FROM public.tb_clientes
-           ORDER BY data_cadastro DESC;"""
+           ORDER BY data_cadastro DESC;""",
+        ["Full Name", "Birth Date", "Gender", "Phone", "Email", "Address", "Register Date"],
+        categorical=("Gender",),
     )
-    if clients_data:
+    if not df_clients.empty:
         st.subheader("All Clients")
-        columns = ["Full Name", "Birth Date", "Gender", "Phone", "Email", "Address", "Register Date"]
-        df_clients = pd.DataFrame(clients_data, columns=columns)
         st.dataframe(df_clients, use_container_width=True)
 
         download_df_as_csv(df_clients, "clients.csv", label="Download Clients CSV")
@@ -734,22 +2018,15 @@ def clients_page():
 def invoice_page():
     st.title("Nota Fiscal")
 
-    open_clients_query = 'SELECT DISTINCT "Cliente" FROM public.vw_pedido_produto WHERE status = %s;'
-    open_clients = run_query(open_clients_query, ('em aberto',))
-    client_list = [row[0] for row in open_clients] if open_clients else []
+    open_clients = run_prepared_df("open_clients", ["Cliente"], ('em aberto',))
+    client_list = open_clients["Cliente"].tolist()
 
     selected_client = st.selectbox("Selecione um Cliente", [""] + client_list)
 
     if selected_client:
-        invoice_query = (
-            'SELECT "Produto", "Quantidade", "total" '
-            'FROM public.vw_pedido_produto '
-            'WHERE "Cliente" = %s AND status = %s;'
-        )
-        invoice_data = run_query(invoice_query, (selected_client, 'em aberto'))
+        df = run_prepared_df("client_open_items", ["Produto", "Quantidade", "total"], (selected_client, 'em aberto'))
 
-        if invoice_data:
-            df = pd.DataFrame(invoice_data, columns=["Produto", "Quantidade", "total"])
+        if not df.empty:
             generate_invoice_for_printer(df)
 
             col1, col2, col3, col4 = st.columns(4)
@@ -772,12 +2049,7 @@ def invoice_page():
 
 
 def process_payment(client, payment_status):
-    query = """
-    UPDATE public.tb_pedido
-    SET status = %s, "Data" = CURRENT_TIMESTAMP
-    WHERE "Cliente" = %s AND status = 'em aberto';
-    """
-    success = run_insert(query, (payment_status, client))
+    success = run_prepared_insert("settle_client_orders", (payment_status, client))
     if success:
         st.success(f"Status atualizado para: {payment_status}")
         refresh_data()
@@ -809,15 +2081,13 @@ def generate_invoice_for_printer(df: pd.DataFrame):
     invoice_note.append("--------------------------------------------------")
 
     grouped_df = df.groupby('Produto').agg({'Quantidade': 'sum', 'total': 'sum'}).reset_index()
-    total_general = 0
+    grouped_df["total_display"] = format_currency_series(grouped_df["total"])
+    total_general = grouped_df["total"].sum()
 
     for _, row in grouped_df.iterrows():
         description = f"{row['Produto'][:20]:<20}"  # limitando a 20 chars
         quantity = f"{int(row['Quantidade']):>5}"
-        total_item = row['total']
-        total_general += total_item
-        total_formatted = format_currency(total_item)
-        invoice_note.append(f"{description} {quantity} {total_formatted}")
+        invoice_note.append(f"{description} {quantity} {row['total_display']}")
 
     invoice_note.append("--------------------------------------------------")
     invoice_note.append(f"{'TOTAL GERAL:':>30} {format_currency(total_general):>10}")
@@ -828,6 +2098,187 @@ def generate_invoice_for_printer(df: pd.DataFrame):
     st.text("\n".join(invoice_note))
 
 
+#####################
+# PÁGINA ANALYTICS
+#####################
+def analytics_page():
+    st.title("Analytics")
+
+    if st.session_state.get("username") != "admin":
+        st.warning("Apenas o administrador pode acessar as análises de vendas.")
+        return
+
+    col_refresh, col_rebuild = st.columns(2)
+    with col_refresh:
+        refresh_cube = st.button("Atualizar cubo", key="refresh_cube_button")
+    with col_rebuild:
+        rebuild_cube = st.button("Reconstruir cubo", key="rebuild_cube_button")
+
+    # O cubo só consulta o banco no botão ou quando passou do intervalo de
+    # atualização; mudanças de filtro respondem apenas a partir da memória.
+    state = get_sales_cube()
+    if refresh_cube or rebuild_cube or sales_cube_is_stale(state):
+        try:
+            state = update_sales_cube(full_rebuild=rebuild_cube)
+            if refresh_cube or rebuild_cube:
+                st.success("Cubo de vendas atualizado.")
+        except QueryError as e:
+            st.error(f"Erro ao atualizar o cubo de vendas; exibindo a última versão. {e}")
+    cube = state["cube"]
+
+    if cube.empty:
+        st.info("Nenhuma venda recebida encontrada.")
+        return
+
+    st.caption(f"Cubo atualizado em {state['updated_at'].strftime('%Y-%m-%d %H:%M:%S')}")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        products = st.multiselect("Produtos", sorted(cube["Produto"].unique().tolist()))
+    with col2:
+        statuses = st.multiselect("Forma de pagamento", PAYMENT_STATUSES)
+    with col3:
+        weekday_names = st.multiselect("Dia da semana", WEEKDAY_LABELS)
+    hour_range = st.slider("Hora do dia", 0, 23, (0, 23))
+
+    start = time.perf_counter()
+    weekdays = [WEEKDAY_LABELS.index(name) for name in weekday_names] or None
+    df_slice = slice_sales_cube(
+        cube,
+        products=products,
+        statuses=statuses,
+        weekdays=weekdays,
+        hours=range(hour_range[0], hour_range[1] + 1),
+    )
+    if df_slice.empty:
+        st.info("Nenhuma venda para os filtros selecionados.")
+        return
+
+    by_product = df_slice.groupby("Produto", as_index=False)[CUBE_MEASURES].sum().sort_values("Total", ascending=False)
+    by_hour = df_slice.groupby("Hora", as_index=False)[CUBE_MEASURES].sum()
+    by_status = df_slice.groupby("status", as_index=False)[CUBE_MEASURES].sum()
+    heatmap = (
+        df_slice.pivot_table(index="DiaSemana", columns="Hora", values="Total", aggfunc="sum", fill_value=0)
+        .reindex(index=range(7), columns=range(24), fill_value=0)
+    )
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    total_sales = by_product["Total"].sum()
+    st.markdown(f"**Total Recebido:** {format_currency(total_sales)}")
+    st.caption(f"Consulta respondida pelo cubo em {elapsed_ms:.1f} ms")
+
+    st.plotly_chart(
+        px.bar(by_product, x="Produto", y="Total", title="Vendas por Produto"),
+        use_container_width=True,
+    )
+    st.plotly_chart(
+        px.bar(by_hour, x="Hora", y="Total", title="Vendas por Hora do Dia"),
+        use_container_width=True,
+    )
+    st.plotly_chart(
+        px.imshow(
+            heatmap.to_numpy(),
+            x=list(range(24)),
+            y=WEEKDAY_LABELS,
+            labels={"x": "Hora", "y": "Dia", "color": "Total"},
+            title="Vendas por Dia da Semana x Hora",
+            aspect="auto",
+        ),
+        use_container_width=True,
+    )
+    st.plotly_chart(
+        px.pie(by_status, names="status", values="Total", title="Vendas por Forma de Pagamento"),
+        use_container_width=True,
+    )
+
+    download_df_as_csv(df_slice, "sales_cube.csv", label="Download Cube CSV")
+
+
+#####################
+# PÁGINA RELATÓRIOS
+#####################
+def reports_page():
+    st.title("Relatórios de Fechamento")
+
+    if st.session_state.get("username") != "admin":
+        st.warning("Apenas o administrador pode acessar os relatórios de fechamento.")
+        return
+
+    with st.form(key='report_form'):
+        report_date = st.date_input("Data do relatório", value=date.today())
+        generate_button = st.form_submit_button(label="Gerar relatório agora")
+
+    if generate_button:
+        try:
+            generate_daily_report(report_date)
+            st.success(f"Relatório de {report_date.strftime('%d/%m/%Y')} gerado com sucesso!")
+        except QueryError as e:
+            st.error(f"Relatório não gerado; o arquivo anterior foi mantido. Erro no banco: {e}")
+
+    st.subheader("Estado dos pedidos em um instante")
+    col_day, col_time = st.columns(2)
+    with col_day:
+        state_date = st.date_input("Dia", value=date.today(), key="order_state_date")
+    with col_time:
+        state_time = st.time_input("Hora", value=datetime.max.time().replace(second=0, microsecond=0), key="order_state_time")
+    if st.button("Reconstruir estado", key="order_state_button"):
+        try:
+            state = load_order_state(datetime.combine(state_date, state_time).astimezone(), days=[state_date])
+        except QueryError as e:
+            st.error(f"Erro ao reconstruir o estado dos pedidos: {e}")
+            return
+        if state is None:
+            st.info("Não há snapshot de pedidos anterior a esse instante.")
+        else:
+            st.caption(f"Snapshot + {state['events_applied']} evento(s) aplicados.")
+            st.markdown("**Comandas em aberto**")
+            open_tabs = state["open_tabs"]
+            if open_tabs.empty:
+                st.info("Nenhuma comanda em aberto.")
+            else:
+                st.dataframe(
+                    open_tabs.groupby(["Cliente", "Produto"], as_index=False)["Quantidade"].sum(),
+                    use_container_width=True,
+                )
+            st.markdown(f"**Totais do dia {state_date.strftime('%d/%m/%Y')}**")
+            daily_totals = state["daily_totals"]
+            day_totals = daily_totals[daily_totals["Quantidade"] != 0]
+            if day_totals.empty:
+                st.info("Nenhuma venda recebida nesse dia.")
+            else:
+                st.dataframe(day_totals.drop(columns="Dia"), use_container_width=True)
+
+    st.subheader("Relatórios arquivados")
+    available = list_daily_reports()
+    if not available:
+        st.info("Nenhum relatório arquivado encontrado.")
+        return
+
+    selected_date = st.selectbox(
+        "Selecione um relatório",
+        available,
+        format_func=lambda d: d.strftime("%d/%m/%Y"),
+    )
+    report = load_daily_report(selected_date)
+
+    st.text(report["text"])
+    st.download_button(
+        label="Baixar relatório (TXT)",
+        data=report["text"],
+        file_name=f"fechamento_{selected_date.strftime('%Y-%m-%d')}.txt",
+        mime="text/plain",
+    )
+
+    for name, label in REPORT_TABLES.items():
+        st.markdown(f"**{label}**")
+        df = report[name]
+        if df.empty:
+            st.info("Sem dados.")
+            continue
+        st.dataframe(df, use_container_width=True)
+        download_df_as_csv(df, f"{name}_{selected_date.strftime('%Y-%m-%d')}.csv", label=f"Download {label} CSV")
+
+
 #####################
 # PÁGINA DE LOGIN
 #####################
@@ -877,48 +2328,94 @@ def login_page():
             st.error("Nome de usuário ou senha incorretos.")
 
 
+#####################
+# VERIFICAÇÃO DO ESQUEMA
+#####################
+REQUIRED_MIGRATIONS = [
+    (
+        "sql/001_particionar_historico.sql",
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = 'public' AND table_name = 'tb_pedido' AND column_name = 'archived')",
+    ),
+    ("sql/002_eventos_pedido.sql", "SELECT to_regclass('public.tb_pedido_evento') IS NOT NULL"),
+]
+
+
+def missing_migrations() -> list:
+    """
+    Retorna, na ordem em que devem ser aplicados, os scripts de sql/ que ainda
+    não foram executados no banco. Levanta QueryError se o banco não responder.
+    """
+    query = "SELECT " + ", ".join(f"({check})" for _, check in REQUIRED_MIGRATIONS) + ";"
+    names = [name for name, _ in REQUIRED_MIGRATIONS]
+    applied = run_query_df(query, names, raise_errors=True)
+    return [name for name in names if not applied[name].iloc[0]]
+
+
 #####################
 # INICIALIZAÇÃO
 #####################
-if 'data' not in st.session_state:
-    st.session_state.data = load_all_data()
+if __name__ == "__main__":
+    if 'missing_migrations' not in st.session_state:
+        try:
+            st.session_state.missing_migrations = missing_migrations()
+        except QueryError:
+            pass  # banco indisponível: as páginas já exibem o erro
+    if st.session_state.get('missing_migrations'):
+        st.error(
+            "O banco de dados não está com o esquema esperado. Aplique, nesta ordem, "
+            "os scripts pendentes (psql -d <banco> -f <script>) e reinicie o aplicativo: "
+            + ", ".join(st.session_state.missing_migrations)
+        )
+        st.stop()
 
-if 'logged_in' not in st.session_state:
-    st.session_state.logged_in = False
+    start_report_scheduler()
+    get_home_snapshot_worker()
 
-if not st.session_state.logged_in:
-    login_page()
-else:
-    selected_page = sidebar_navigation()
+    if 'data' not in st.session_state:
+        st.session_state.data = load_all_data()
 
-    if 'current_page' not in st.session_state:
-        st.session_state.current_page = selected_page
-    elif selected_page != st.session_state.current_page:
-        refresh_data()
-        st.session_state.current_page = selected_page
-        if selected_page == "Home":
-            st.session_state.home_page_initialized = False
-
-    # Roteamento de Páginas
-    if selected_page == "Home":
-        home_page()
-    elif selected_page == "Orders":
-        orders_page()
-    elif selected_page == "Products":
-        products_page()
-    elif selected_page == "Stock":
-        stock_page()
-    elif selected_page == "Clients":
-        clients_page()
-    elif selected_page == "Nota Fiscal":
-        invoice_page()
+    if 'logged_in' not in st.session_state:
+        st.session_state.logged_in = False
 
-    with st.sidebar:
-        if st.button("Logout"):
-            keys_to_reset = ['home_page_initialized']
-            for key in keys_to_reset:
-                if key in st.session_state:
-                    del st.session_state[key]
-            st.session_state.logged_in = False
-            st.success("Desconectado com sucesso!")
-            st.experimental_rerun()
+    if not st.session_state.logged_in:
+        login_page()
+    else:
+        selected_page = sidebar_navigation()
+
+        if 'current_page' not in st.session_state:
+            st.session_state.current_page = selected_page
+        elif selected_page != st.session_state.current_page:
+            refresh_data()
+            st.session_state.current_page = selected_page
+            if selected_page == "Home":
+                st.session_state.home_page_initialized = False
+
+        # Roteamento de Páginas
+        if selected_page == "Home":
+            home_page()
+        elif selected_page == "Orders":
+            orders_page()
+        elif selected_page == "Products":
+            products_page()
+        elif selected_page == "Stock":
+            stock_page()
+        elif selected_page == "Clients":
+            clients_page()
+        elif selected_page == "Nota Fiscal":
+            invoice_page()
+        elif selected_page == "Analytics":
+            analytics_page()
+        elif selected_page == "Relatórios":
+            reports_page()
+
+        with st.sidebar:
+            render_db_status()
+            if st.button("Logout"):
+                keys_to_reset = ['home_page_initialized', 'include_archive']
+                for key in keys_to_reset:
+                    if key in st.session_state:
+                        del st.session_state[key]
+                st.session_state.logged_in = False
+                st.success("Desconectado com sucesso!")
+                st.experimental_rerun()
@@ -0,0 +1,342 @@
+"""
+Teste de carga do aplicativo.py com sessões concorrentes.
+
+Usa a API de testes do Streamlit (streamlit.testing.v1.AppTest) para executar o
+aplicativo sem navegador. Cada sessão simulada faz login (admin ou caixa),
+navega pelas páginas, registra pedidos e fecha comandas no banco PostgreSQL
+informado. Ao final são exibidos os percentis de latência por ação, o número
+de conexões abertas no banco e o uso de memória dos processos.
+
+Cada sessão roda em um processo próprio: o AppTest registra o Runtime do
+Streamlit numa variável global do processo e não suporta vários reruns em
+paralelo no mesmo processo. Por isso cada sessão tem também o seu próprio pool
+de conexões. Erros da página (st.error/st.exception) são contados como erros do
+aplicativo; exceções levantadas pelo próprio AppTest, como erros do harness.
+
+ATENÇÃO: o teste grava pedidos e altera comandas. Use apenas um banco local de teste.
+
+Exemplo:
+    python load_test.py --sessions 8 --iterations 20 --db-name beach_test
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import psycopg2
+import streamlit as st
+import streamlit_option_menu
+from streamlit.testing.v1 import AppTest
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "aplicativo.py")
+PAGES = ["Home", "Orders", "Products", "Stock", "Clients", "Nota Fiscal", "Analytics", "Relatórios"]
+CREDENTIALS = {"admin": "adminbeach", "caixa": "caixabeach"}
+PAGE_STATE_KEY = "_load_test_page"
+
+
+########################
+# NAVEGAÇÃO
+########################
+def _option_menu_stub(menu_title, options, default_index=0, **kwargs):
+    """
+    O option_menu é um componente customizado e não pode ser clicado pelo AppTest.
+    Durante o teste ele é substituído por esta função, que devolve a página
+    escolhida pela sessão simulada (guardada no session_state da própria sessão).
+    """
+    return st.session_state.get(PAGE_STATE_KEY, options[default_index])
+
+
+streamlit_option_menu.option_menu = _option_menu_stub
+
+
+########################
+# MÉTRICAS
+########################
+class Metrics:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.harness_errors = defaultdict(int)
+        self.messages = defaultdict(Counter)
+        self.connection_samples = []
+        self.session_rss_mb = []
+
+    def record(self, action, seconds, app_messages=(), harness_message=None):
+        self.latencies[action].append(seconds)
+        if app_messages:
+            self.errors[action] += 1
+            self.messages[action].update(app_messages)
+        if harness_message:
+            self.harness_errors[action] += 1
+            self.messages[action][f"[harness] {harness_message}"] += 1
+
+    def merge(self, other):
+        for action, values in other.latencies.items():
+            self.latencies[action].extend(values)
+        for action, count in other.errors.items():
+            self.errors[action] += count
+        for action, count in other.harness_errors.items():
+            self.harness_errors[action] += count
+        for action, messages in other.messages.items():
+            self.messages[action].update(messages)
+        self.session_rss_mb.extend(other.session_rss_mb)
+
+
+def current_rss_mb():
+    """
+    Memória residente atual do processo (Linux); cai para o pico do getrusage nos demais sistemas.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def monitor_connections(db, metrics, stop, interval):
+    """
+    Amostra periodicamente o número de conexões abertas no banco (pg_stat_activity).
+    """
+    conn = psycopg2.connect(**db)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            while not stop.is_set():
+                cursor.execute(
+                    "SELECT count(*) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid();",
+                    (db["database"],),
+                )
+                metrics.connection_samples.append(cursor.fetchone()[0])
+                stop.wait(interval)
+    finally:
+        conn.close()
+
+
+########################
+# SESSÃO SIMULADA
+########################
+def timed_run(at, metrics, action):
+    """
+    Executa um rerun. Se a página exibir st.exception ou st.error (o aplicativo
+    trata erros de banco com st.error), conta um erro do aplicativo; se o próprio
+    at.run() levantar exceção, conta um erro do harness.
+    Retorna False só no segundo caso: a página pode ter erros e ainda ser usável.
+    """
+    start = time.perf_counter()
+    app_messages, harness_message = [], None
+    try:
+        at.run()
+        app_messages = [str(e.value) for e in at.exception] + [str(e.value) for e in at.error]
+    except Exception as e:
+        harness_message = f"{type(e).__name__}: {e}"
+    metrics.record(action, time.perf_counter() - start, app_messages, harness_message)
+    return harness_message is None
+
+
+def find_widget(elements, label=None, key=None):
+    for element in elements:
+        if (label is None or element.label == label) and (key is None or element.key == key):
+            return element
+    return None
+
+
+def navigate(at, metrics, page):
+    at.session_state[PAGE_STATE_KEY] = page
+    return timed_run(at, metrics, f"page:{page}")
+
+
+def register_order(at, metrics, rng):
+    customer = find_widget(at.selectbox, label="Customer Name")
+    product = find_widget(at.selectbox, label="Product")
+    submit = find_widget(at.button, label="Register Order")
+    if customer is None or product is None or submit is None:
+        return
+    customers = [c for c in customer.options if c]
+    products = [p for p in product.options if p and p != "No products available"]
+    if not customers or not products:
+        return
+    customer.select(rng.choice(customers))
+    product.select(rng.choice(products))
+    find_widget(at.number_input, label="Quantity").set_value(rng.randint(1, 3))
+    submit.click()
+    timed_run(at, metrics, "action:register_order")
+
+
+def settle_tab(at, metrics, rng):
+    client = find_widget(at.selectbox, label="Selecione um Cliente")
+    clients = [c for c in client.options if c] if client is not None else []
+    if not clients:
+        return
+    client.select(rng.choice(clients))
+    if not timed_run(at, metrics, "action:select_client"):
+        return
+    pay = find_widget(at.button, key=rng.choice(["debit_button", "credit_button", "pix_button", "cash_button"]))
+    if pay is not None:
+        pay.click()
+        timed_run(at, metrics, "action:settle_tab")
+
+
+def run_session(session_id, role, args, db):
+    """
+    Executa uma sessão simulada (em um processo próprio) e devolve suas métricas.
+    """
+    metrics = Metrics()
+    try:
+        _run_session(session_id, role, args, db, metrics)
+    except Exception as e:
+        print(f"[session-{session_id}] sessão interrompida: {type(e).__name__}: {e}")
+    metrics.session_rss_mb.append(peak_rss_mb())
+    return metrics
+
+
+def _run_session(session_id, role, args, db, metrics):
+    rng = random.Random(args.seed + session_id)
+    at = AppTest.from_file(APP_FILE, default_timeout=args.timeout)
+    at.secrets["db"] = {
+        "host": db["host"],
+        "name": db["database"],
+        "user": db["user"],
+        "password": db["password"],
+        "port": db["port"],
+    }
+    # Erros na tela de login (ex.: logotipo indisponível sem internet) não
+    # impedem o login; só desiste se o formulário não estiver na página.
+    timed_run(at, metrics, "login_page")
+    username = find_widget(at.text_input, label="Username")
+    password = find_widget(at.text_input, label="Password")
+    login = find_widget(at.button, label="Login")
+    if username is None or password is None or login is None:
+        return
+
+    username.input(role)
+    password.input(CREDENTIALS[role])
+    login.click()
+    if not timed_run(at, metrics, "action:login") or not ("logged_in" in at.session_state and at.session_state["logged_in"]):
+        return
+
+    for _ in range(args.iterations):
+        page = rng.choice(PAGES)
+        if not navigate(at, metrics, page):
+            continue
+        if page == "Orders" and rng.random() < args.order_ratio:
+            register_order(at, metrics, rng)
+        elif page == "Nota Fiscal" and rng.random() < args.settle_ratio:
+            settle_tab(at, metrics, rng)
+        if args.think_time:
+            time.sleep(rng.uniform(0, args.think_time))
+
+
+########################
+# RELATÓRIO
+########################
+def print_report(metrics, elapsed, rss_before):
+    print(f"\nDuração total: {elapsed:.1f} s")
+    print(
+        f"{'AÇÃO':<28} {'N':>6} {'ERROS':>6} {'HARNESS':>8} "
+        f"{'P50 ms':>9} {'P90 ms':>9} {'P99 ms':>9} {'MÁX ms':>9}"
+    )
+    print("-" * 91)
+    all_latencies = []
+    for action in sorted(metrics.latencies):
+        values = np.array(metrics.latencies[action]) * 1000
+        all_latencies.extend(values)
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        print(
+            f"{action:<28} {len(values):>6} {metrics.errors[action]:>6} {metrics.harness_errors[action]:>8} "
+            f"{p50:>9.1f} {p90:>9.1f} {p99:>9.1f} {values.max():>9.1f}"
+        )
+    if all_latencies:
+        p50, p90, p99 = np.percentile(all_latencies, [50, 90, 99])
+        print("-" * 91)
+        print(f"{'TODOS OS RERUNS':<28} {len(all_latencies):>6} {sum(metrics.errors.values()):>6} "
+              f"{sum(metrics.harness_errors.values()):>8} {p50:>9.1f} {p90:>9.1f} {p99:>9.1f} {max(all_latencies):>9.1f}")
+
+    failed_actions = [action for action in sorted(metrics.messages) if metrics.messages[action]]
+    if failed_actions:
+        print("\nMensagens de erro por ação:")
+        for action in failed_actions:
+            print(f"  {action}")
+            for message, count in metrics.messages[action].most_common(5):
+                print(f"    {count:>5}x {message[:100]}")
+
+    if metrics.connection_samples:
+        samples = np.array(metrics.connection_samples)
+        print(f"\nConexões no banco: média {samples.mean():.1f}, máximo {samples.max()}")
+    print(f"Memória do processo principal: início {rss_before:.1f} MB, final {current_rss_mb():.1f} MB")
+    if metrics.session_rss_mb:
+        samples = np.array(metrics.session_rss_mb)
+        print(f"Pico de memória por sessão: média {samples.mean():.1f} MB, máximo {samples.max():.1f} MB")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Teste de carga do aplicativo com sessões concorrentes.")
+    parser.add_argument("--sessions", type=int, default=4, help="Número de sessões simultâneas.")
+    parser.add_argument("--iterations", type=int, default=10, help="Navegações por sessão.")
+    parser.add_argument("--admin-ratio", type=float, default=0.5, help="Fração das sessões logadas como admin.")
+    parser.add_argument("--order-ratio", type=float, default=0.5, help="Chance de registrar um pedido na página Orders.")
+    parser.add_argument("--settle-ratio", type=float, default=0.3, help="Chance de fechar uma comanda na Nota Fiscal.")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Pausa máxima (s) entre navegações.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Tempo máximo (s) de cada rerun.")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Intervalo (s) da amostragem de conexões.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db-host", default=os.environ.get("PGHOST", "localhost"))
+    parser.add_argument("--db-port", type=int, default=int(os.environ.get("PGPORT", 5432)))
+    parser.add_argument("--db-name", default=os.environ.get("PGDATABASE", "postgres"))
+    parser.add_argument("--db-user", default=os.environ.get("PGUSER", "postgres"))
+    parser.add_argument("--db-password", default=os.environ.get("PGPASSWORD", ""))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db = {
+        "host": args.db_host,
+        "port": args.db_port,
+        "database": args.db_name,
+        "user": args.db_user,
+        "password": args.db_password,
+    }
+    metrics = Metrics()
+    rss_before = current_rss_mb()
+
+    stop = threading.Event()
+    monitor = threading.Thread(
+        target=monitor_connections, args=(db, metrics, stop, args.sample_interval), daemon=True
+    )
+    monitor.start()
+
+    admins = round(args.sessions * args.admin_ratio)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.sessions, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        sessions = [
+            executor.submit(run_session, i, "admin" if i < admins else "caixa", args, db)
+            for i in range(args.sessions)
+        ]
+        for i, session in enumerate(sessions):
+            try:
+                metrics.merge(session.result())
+            except Exception as e:
+                print(f"[session-{i}] processo encerrado com erro: {type(e).__name__}: {e}")
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    monitor.join()
+    print(f"Sessões: {args.sessions} ({admins} admin, {args.sessions - admins} caixa)")
+    print_report(metrics, elapsed, rss_before)
+
+
+if __name__ == "__main__":
+    main()
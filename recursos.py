@@ -0,0 +1,31 @@
+"""
+Objetos compartilhados pelo processo inteiro (pool de conexões, disjuntor,
+cubo de vendas, tarefas em segundo plano).
+
+O Streamlit reexecuta aplicativo.py a cada interação e recria suas variáveis
+globais, por isso o registro fica neste módulo, importado uma única vez.
+Ao contrário de st.cache_resource, que sem contexto de script (em threads
+próprias) cria um objeto novo a cada chamada, process_singleton devolve sempre
+o mesmo objeto em qualquer thread.
+"""
+import functools
+import threading
+
+_lock = threading.RLock()
+_objects = {}
+
+
+def process_singleton(create):
+    """
+    Decorador: a primeira chamada executa `create` (sob um lock, uma única vez
+    por processo) e as seguintes devolvem o mesmo objeto. A chave é o nome da
+    função, pois a cada execução do script ela é redefinida.
+    """
+    @functools.wraps(create)
+    def get():
+        with _lock:
+            if create.__name__ not in _objects:
+                _objects[create.__name__] = create()
+            return _objects[create.__name__]
+
+    return get
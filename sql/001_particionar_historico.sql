@@ -0,0 +1,277 @@
+-- Particionamento mensal de tb_pedido e tb_estoque com arquivamento automático.
+--
+-- Cada tabela passa a ser particionada por LIST (archived):
+--   <tabela>_hot      (archived = false) -> RANGE ("Data") por mês
+--   <tabela>_archive  (archived = true)  -> RANGE ("Data") por mês
+-- Consultas com "WHERE NOT archived" só leem as partições quentes.
+--
+-- As views que dependem das tabelas (ex.: vw_pedido_produto) são recriadas com a
+-- mesma definição, apontando para a nova tabela particionada. Também são
+-- recriados na nova tabela:
+--   * chave primária e restrições UNIQUE, com "Data" e archived acrescentados à
+--     chave (exigência do PostgreSQL para tabelas particionadas);
+--   * chaves estrangeiras para outras tabelas, demais índices e triggers;
+--   * dono e GRANTs da tabela original (o dono também passa a ser dono das partições).
+-- Colunas serial são mantidas. Não são suportados: colunas IDENTITY, chaves
+-- estrangeiras de outras tabelas apontando para estas, índices únicos fora de
+-- restrições e restrições EXCLUDE; nesses casos o script aborta sem alterar nada.
+-- Requer PostgreSQL 13 ou superior.
+--
+-- Execute uma única vez, antes de 002_eventos_pedido.sql e antes de subir a
+-- versão do aplicativo que lê a coluna archived (ele recusa iniciar sem ela):
+--   psql -d <banco> -f sql/001_particionar_historico.sql
+-- Depois disso o aplicativo chama fn_manutencao_historico diariamente.
+
+BEGIN;
+
+-- A cópia do histórico pode passar do statement_timeout configurado para o usuário.
+SET LOCAL statement_timeout = 0;
+
+-- Cria (se não existirem) as partições mensais quentes e de arquivo que contêm `mes`.
+-- Linhas desse mês que estejam na partição DEFAULT são movidas para a nova partição.
+CREATE OR REPLACE FUNCTION public.fn_criar_particoes_mes(tabela text, mes date)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    inicio timestamp := date_trunc('month', mes);
+    fim timestamp := date_trunc('month', mes) + interval '1 month';
+    camada text;
+    pai text;
+    particao text;
+BEGIN
+    FOREACH camada IN ARRAY ARRAY['hot', 'archive'] LOOP
+        pai := format('%s_%s', tabela, camada);
+        particao := format('%s_%s', pai, to_char(inicio, 'YYYYMM'));
+        IF to_regclass(format('public.%I', particao)) IS NOT NULL THEN
+            CONTINUE;
+        END IF;
+
+        EXECUTE format('CREATE TABLE public.%I (LIKE public.%I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', particao, pai);
+        EXECUTE format(
+            'WITH movidas AS (DELETE FROM public.%I WHERE "Data" >= %L AND "Data" < %L RETURNING *) '
+            'INSERT INTO public.%I SELECT * FROM movidas',
+            pai || '_default', inicio, fim, particao
+        );
+        EXECUTE format(
+            'ALTER TABLE public.%I ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+            pai, particao, inicio, fim
+        );
+    END LOOP;
+END;
+$$;
+
+
+-- Converte uma tabela comum com coluna "Data" na estrutura particionada descrita acima.
+CREATE OR REPLACE FUNCTION public.fn_particionar_tabela(tabela text)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    antiga text := tabela || '_old';
+    original regclass := format('public.%I', tabela)::regclass;
+    dono text;
+    view_rec record;
+    seq_rec record;
+    rec record;
+    mes date;
+    ultimo date;
+    views_dependentes text[][] := ARRAY[]::text[][];
+    objetos text[] := ARRAY[]::text[];
+    comando text;
+    i integer;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_constraint WHERE confrelid = original AND contype = 'f') THEN
+        RAISE EXCEPTION 'public.% é referenciada por chaves estrangeiras de outras tabelas; remova-as antes de particionar', tabela;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = original AND contype = 'x') THEN
+        RAISE EXCEPTION 'public.% tem restrições EXCLUDE, não suportadas em tabelas particionadas', tabela;
+    END IF;
+
+    -- Guarda as definições das views antes do RENAME (o texto ainda cita o nome original).
+    FOR view_rec IN
+        SELECT DISTINCT v.oid::regclass::text AS nome,
+               regexp_replace(pg_get_viewdef(v.oid), ';\s*$', '') AS definicao
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        JOIN pg_class v ON v.oid = r.ev_class
+        WHERE d.classid = 'pg_rewrite'::regclass
+          AND d.refobjid = format('public.%I', tabela)::regclass
+          AND v.relkind = 'v'
+    LOOP
+        views_dependentes := views_dependentes || ARRAY[[view_rec.nome, view_rec.definicao]];
+    END LOOP;
+
+    -- Guarda também os comandos que recriam restrições, índices, triggers, dono e
+    -- GRANTs; eles rodam depois que a tabela antiga (e seus nomes) deixar de existir.
+    FOR rec IN
+        SELECT c.conname,
+               CASE c.contype WHEN 'p' THEN 'PRIMARY KEY' ELSE 'UNIQUE' END AS tipo,
+               string_agg(quote_ident(a.attname), ', ' ORDER BY k.ordem) AS colunas,
+               bool_or(a.attname = 'Data') AS tem_data
+        FROM pg_constraint c
+        CROSS JOIN LATERAL unnest(c.conkey) WITH ORDINALITY AS k(attnum, ordem)
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+        WHERE c.conrelid = original AND c.contype IN ('p', 'u')
+        GROUP BY c.conname, c.contype
+        ORDER BY c.contype
+    LOOP
+        objetos := objetos || format(
+            'ALTER TABLE public.%I ADD CONSTRAINT %I %s (%s%s, archived)',
+            tabela, rec.conname, rec.tipo, rec.colunas, CASE WHEN rec.tem_data THEN '' ELSE ', "Data"' END
+        );
+    END LOOP;
+
+    FOR rec IN
+        SELECT conname, pg_get_constraintdef(oid) AS definicao
+        FROM pg_constraint
+        WHERE conrelid = original AND contype = 'f'
+    LOOP
+        objetos := objetos || format('ALTER TABLE public.%I ADD CONSTRAINT %I %s', tabela, rec.conname, rec.definicao);
+    END LOOP;
+
+    FOR rec IN
+        SELECT i.indexrelid::regclass::text AS nome, i.indisunique, pg_get_indexdef(i.indexrelid) AS definicao
+        FROM pg_index i
+        WHERE i.indrelid = original
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conrelid = original AND c.conindid = i.indexrelid)
+    LOOP
+        IF rec.indisunique THEN
+            RAISE EXCEPTION 'índice único % fora de restrição não é suportado; converta-o em UNIQUE antes de particionar', rec.nome;
+        END IF;
+        objetos := objetos || rec.definicao;
+    END LOOP;
+
+    FOR rec IN
+        SELECT pg_get_triggerdef(oid) AS definicao
+        FROM pg_trigger
+        WHERE tgrelid = original AND NOT tgisinternal
+    LOOP
+        objetos := objetos || rec.definicao;
+    END LOOP;
+
+    SELECT pg_get_userbyid(relowner) INTO dono FROM pg_class WHERE oid = original;
+    FOR rec IN
+        SELECT CASE a.grantee WHEN 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END AS grantee,
+               a.privilege_type, a.is_grantable
+        FROM pg_class c
+        CROSS JOIN LATERAL aclexplode(c.relacl) AS a
+        WHERE c.oid = original AND a.grantee <> c.relowner
+    LOOP
+        objetos := objetos || format(
+            'GRANT %s ON public.%I TO %s%s',
+            rec.privilege_type, tabela, rec.grantee, CASE WHEN rec.is_grantable THEN ' WITH GRANT OPTION' ELSE '' END
+        );
+    END LOOP;
+
+    EXECUTE format('ALTER TABLE public.%I RENAME TO %I', tabela, antiga);
+    EXECUTE format(
+        'CREATE TABLE public.%I (LIKE public.%I INCLUDING DEFAULTS INCLUDING CONSTRAINTS, '
+        'archived boolean NOT NULL DEFAULT false) PARTITION BY LIST (archived)',
+        tabela, antiga
+    );
+    EXECUTE format(
+        'CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES IN (false) PARTITION BY RANGE ("Data")',
+        tabela || '_hot', tabela
+    );
+    EXECUTE format(
+        'CREATE TABLE public.%I PARTITION OF public.%I FOR VALUES IN (true) PARTITION BY RANGE ("Data")',
+        tabela || '_archive', tabela
+    );
+    EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I DEFAULT', tabela || '_hot_default', tabela || '_hot');
+    EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I DEFAULT', tabela || '_archive_default', tabela || '_archive');
+    EXECUTE format('CREATE INDEX ON public.%I ("Data")', tabela);
+
+    -- Uma partição por mês do histórico existente até o mês seguinte ao atual.
+    EXECUTE format('SELECT COALESCE(min("Data")::date, current_date) FROM public.%I', antiga) INTO mes;
+    ultimo := (date_trunc('month', current_date) + interval '1 month')::date;
+    WHILE mes <= ultimo LOOP
+        PERFORM public.fn_criar_particoes_mes(tabela, mes);
+        mes := (date_trunc('month', mes) + interval '1 month')::date;
+    END LOOP;
+
+    EXECUTE format('INSERT INTO public.%I SELECT *, false FROM public.%I', tabela, antiga);
+
+    -- Sequências de colunas serial passam a pertencer à nova tabela.
+    FOR seq_rec IN
+        SELECT s.oid::regclass::text AS sequencia, a.attname AS coluna
+        FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.refobjid = format('public.%I', antiga)::regclass
+          AND d.deptype = 'a'
+    LOOP
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY public.%I.%I', seq_rec.sequencia, tabela, seq_rec.coluna);
+    END LOOP;
+
+    IF array_length(views_dependentes, 1) IS NOT NULL THEN
+        FOR i IN 1 .. array_length(views_dependentes, 1) LOOP
+            EXECUTE format('CREATE OR REPLACE VIEW %s AS %s', views_dependentes[i][1], views_dependentes[i][2]);
+        END LOOP;
+    END IF;
+
+    EXECUTE format('DROP TABLE public.%I', antiga);
+
+    FOREACH comando IN ARRAY objetos LOOP
+        EXECUTE comando;
+    END LOOP;
+
+    -- O aplicativo cria e anexa partições em fn_manutencao_historico, o que exige
+    -- ser dono da tabela e das partições DEFAULT.
+    FOR rec IN SELECT relid FROM pg_partition_tree(format('public.%I', tabela)::regclass) LOOP
+        EXECUTE format('ALTER TABLE %s OWNER TO %I', rec.relid, dono);
+    END LOOP;
+END;
+$$;
+
+
+-- Move para as partições de arquivo os pedidos já pagos e os registros de
+-- estoque com "Data" anterior a `idade`. Retorna o número de linhas arquivadas.
+-- O primeiro arquivamento pode mover meses de histórico: chame depois de
+-- "SET LOCAL statement_timeout = 0" na mesma transação (como faz o aplicativo),
+-- pois o limite definido dentro da função não vale para o comando já em execução.
+CREATE OR REPLACE FUNCTION public.fn_arquivar_historico(idade interval)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    pedidos integer;
+    estoque integer;
+BEGIN
+    UPDATE public.tb_pedido
+    SET archived = true
+    WHERE NOT archived AND status <> 'em aberto' AND "Data" < now() - idade;
+    GET DIAGNOSTICS pedidos = ROW_COUNT;
+
+    UPDATE public.tb_estoque
+    SET archived = true
+    WHERE NOT archived AND "Data" < now() - idade;
+    GET DIAGNOSTICS estoque = ROW_COUNT;
+
+    RETURN pedidos + estoque;
+END;
+$$;
+
+
+-- Rotina diária: garante as partições do mês atual e do próximo e arquiva o histórico antigo.
+CREATE OR REPLACE FUNCTION public.fn_manutencao_historico(idade interval)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    tabela text;
+BEGIN
+    FOREACH tabela IN ARRAY ARRAY['tb_pedido', 'tb_estoque'] LOOP
+        PERFORM public.fn_criar_particoes_mes(tabela, current_date);
+        PERFORM public.fn_criar_particoes_mes(tabela, (current_date + interval '1 month')::date);
+    END LOOP;
+    RETURN public.fn_arquivar_historico(idade);
+END;
+$$;
+
+
+SELECT public.fn_particionar_tabela('tb_pedido');
+SELECT public.fn_particionar_tabela('tb_estoque');
+CREATE INDEX ON public.tb_pedido (status, "Cliente");
+
+COMMIT;
@@ -0,0 +1,86 @@
+-- Log de eventos de pedidos (somente inserção) e snapshots periódicos.
+--
+-- Toda gravação em tb_pedido feita pelo aplicativo registra, no mesmo comando,
+-- um evento em tb_pedido_evento: created, edited, paid ou deleted. O evento
+-- guarda o estado da linha depois da operação (antes, no caso de deleted) e,
+-- em `anterior`, os valores que a operação substituiu.
+--
+-- Os snapshots guardam as comandas em aberto e os totais diários (quantidade por
+-- dia, produto e forma de pagamento) até o evento `ultimo_evento_id`. O snapshot
+-- inicial tem todos os dias do histórico; os seguintes, só os dias alterados desde
+-- o anterior. Os totais de um dia são os do snapshot mais recente que o contém.
+-- O estado em qualquer instante é o snapshot mais recente anterior a ele mais os
+-- eventos seguintes. O aplicativo apaga snapshots antigos (ver prune_order_snapshots).
+--
+-- Execute uma única vez, depois de 001_particionar_historico.sql e antes de subir
+-- a versão do aplicativo que grava eventos (sem a tabela, toda gravação de pedido
+-- falharia; o aplicativo recusa iniciar enquanto o script não for aplicado):
+--   psql -d <banco> -f sql/002_eventos_pedido.sql
+
+BEGIN;
+
+CREATE TABLE public.tb_pedido_evento (
+    id bigserial PRIMARY KEY,
+    ocorrido_em timestamptz NOT NULL DEFAULT now(),
+    tipo text NOT NULL CHECK (tipo IN ('created', 'edited', 'paid', 'deleted')),
+    "Cliente" text NOT NULL,
+    "Produto" text NOT NULL,
+    "Quantidade" integer NOT NULL,
+    "Data" timestamp NOT NULL,
+    status text NOT NULL,
+    anterior jsonb
+);
+CREATE INDEX ON public.tb_pedido_evento (ocorrido_em);
+
+-- Eventos não podem ser alterados nem apagados.
+CREATE RULE tb_pedido_evento_sem_update AS ON UPDATE TO public.tb_pedido_evento DO INSTEAD NOTHING;
+CREATE RULE tb_pedido_evento_sem_delete AS ON DELETE TO public.tb_pedido_evento DO INSTEAD NOTHING;
+
+CREATE TABLE public.tb_snapshot_pedido (
+    id bigserial PRIMARY KEY,
+    gerado_em timestamptz NOT NULL,
+    ultimo_evento_id bigint NOT NULL
+);
+CREATE INDEX ON public.tb_snapshot_pedido (gerado_em);
+
+CREATE TABLE public.tb_snapshot_comanda (
+    snapshot_id bigint NOT NULL REFERENCES public.tb_snapshot_pedido (id) ON DELETE CASCADE,
+    "Cliente" text NOT NULL,
+    "Produto" text NOT NULL,
+    "Data" timestamp NOT NULL,
+    "Quantidade" integer NOT NULL
+);
+CREATE INDEX ON public.tb_snapshot_comanda (snapshot_id);
+
+CREATE TABLE public.tb_snapshot_total_diario (
+    snapshot_id bigint NOT NULL REFERENCES public.tb_snapshot_pedido (id) ON DELETE CASCADE,
+    dia date NOT NULL,
+    "Produto" text NOT NULL,
+    status text NOT NULL,
+    "Quantidade" integer NOT NULL
+);
+CREATE INDEX ON public.tb_snapshot_total_diario (snapshot_id);
+CREATE INDEX ON public.tb_snapshot_total_diario (dia, snapshot_id);
+
+-- Snapshot inicial a partir do estado atual (ainda sem eventos).
+LOCK TABLE public.tb_pedido IN SHARE MODE;
+
+WITH snap AS (
+    INSERT INTO public.tb_snapshot_pedido (gerado_em, ultimo_evento_id)
+    VALUES (now(), 0)
+    RETURNING id
+),
+comandas AS (
+    INSERT INTO public.tb_snapshot_comanda (snapshot_id, "Cliente", "Produto", "Data", "Quantidade")
+    SELECT snap.id, p."Cliente", p."Produto", p."Data", SUM(p."Quantidade")
+    FROM snap, public.tb_pedido p
+    WHERE p.status = 'em aberto'
+    GROUP BY snap.id, p."Cliente", p."Produto", p."Data"
+)
+INSERT INTO public.tb_snapshot_total_diario (snapshot_id, dia, "Produto", status, "Quantidade")
+SELECT snap.id, DATE(p."Data"), p."Produto", p.status, SUM(p."Quantidade")
+FROM snap, public.tb_pedido p
+WHERE p.status <> 'em aberto'
+GROUP BY snap.id, DATE(p."Data"), p."Produto", p.status;
+
+COMMIT;
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aplicativo import format_currency, format_currency_series  # noqa: E402
+
+VALUES = [
+    0, 0.01, 0.005, 0.015, -0.015, 2.675, 1234.56, -1234.56, 1234.565,
+    999.995, -0.001, 12.5, 1234567.891, 1e9 + 0.125,
+]
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1234.56, "R$ 1.234,56"),
+    (0.015, "R$ 0,02"),
+    (2.675, "R$ 2,68"),
+    (1234.565, "R$ 1.234,57"),
+    (-1234.56, "R$ -1.234,56"),
+    (-0.001, "R$ 0,00"),
+])
+def test_format_currency(value, expected):
+    assert format_currency(value) == expected
+
+
+def test_series_matches_scalar():
+    formatted = format_currency_series(VALUES)
+    assert formatted.tolist() == [format_currency(value) for value in VALUES]
+
+
+def test_series_keeps_index_and_blanks_missing():
+    formatted = format_currency_series(pd.Series([None, 1.0], index=[10, 20]))
+    assert formatted.index.tolist() == [10, 20]
+    assert formatted.tolist() == ["", "R$ 1,00"]
@@ -0,0 +1,33 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recursos import process_singleton  # noqa: E402
+
+
+def test_same_object_across_threads_and_redefinitions():
+    calls = []
+
+    def make_shared():
+        calls.append(1)
+        return object()
+
+    first = process_singleton(make_shared)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(first())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Uma nova execução do script redefine a função com o mesmo nome.
+    def make_shared():  # noqa: F811
+        calls.append(1)
+        return object()
+
+    again = process_singleton(make_shared)
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert again() is results[0]